@@ -18,6 +18,7 @@ from CTFd.utils.config import is_teams_mode
 from CTFd.api import CTFd_API_v1
 from CTFd.api.v1.scoreboard import ScoreboardDetail
 import CTFd.utils.scores
+from CTFd.cache import cache
 from CTFd.api.v1.challenges import ChallengeList, Challenge
 from flask_restx import Namespace, Resource
 from flask import request, Blueprint, jsonify, abort, render_template, url_for, redirect, session
@@ -360,8 +361,12 @@ def create_container(docker, image, team, portbl):
 
 def delete_container(docker, instance_id):
     headers = {'Content-Type': "application/json"}
-    do_request(docker, f'/containers/{instance_id}?force=true', headers=headers, method='DELETE')
-    return True
+    r = do_request(docker, f'/containers/{instance_id}?force=true', headers=headers, method='DELETE')
+    if r == []:
+        # The daemon could not be reached
+        return False
+    # 404 means the container is already gone
+    return r.status_code in (204, 404)
 
 
 class DockerChallengeType(BaseChallenge):
@@ -641,36 +646,59 @@ class ContainerAPI(Resource):
         }
 
 
+# Expired instances are looked up through the revert_time index and the monitor sleeps until the next one is due.
+# Instances started by other worker processes are not known here, so it never sleeps longer than MONITOR_MAX_SLEEP.
+MONITOR_MAX_SLEEP = 30
+MONITOR_RETRY_DELAY = 10
+MONITOR_LOCK_KEY = 'docker_challenges_monitor_lock'
+
+
+def kill_expired_instances(docker):
+    """
+	Deletes every instance whose revert_time has passed and returns the number of seconds until the next one
+	expires (None when nothing is tracked). Containers the daemon failed to remove are kept and retried later.
+	"""
+    now = unix_time(datetime.utcnow())
+    expired = DockerChallengeTracker.query.filter(DockerChallengeTracker.revert_time <= now).all()
+    removed = list()
+    failed = False
+    for instance in expired:
+        if delete_container(docker, instance.instance_id):
+            removed.append(instance.id)
+        else:
+            print(f"[Monitor] Could not kill expired instance {instance.instance_id}, retrying later")
+            failed = True
+    if removed:
+        print(f"[Monitor] Killed {len(removed)} expired instance(s)")
+        DockerChallengeTracker.query.filter(DockerChallengeTracker.id.in_(removed)).delete(synchronize_session=False)
+        db.session.commit()
+    if failed:
+        return MONITOR_RETRY_DELAY
+    next_expiry = db.session.query(db.func.min(DockerChallengeTracker.revert_time)).scalar()
+    if next_expiry is None:
+        return None
+    return max(int(next_expiry) - now, 1)
+
+
 def monitor_containers(app):
     with app.app_context():
         while True:
-            try:
-                # 1. Force the database session to refresh
-                db.session.expire_all()
-                db.session.commit() # Calling commit helps clear stale transaction states
-                
-                docker = DockerConfig.query.filter_by(id=1).first()
-                if docker:
-                    # 2. Use a slightly padded 'now' to account for sync drift
-                    # We add 2 seconds to 'now' to ensure we catch everything the JS sees
-                    now = unix_time(datetime.utcnow()) + 2
-                    
-                    all_instances = DockerChallengeTracker.query.all()
-                    
-                    for instance in all_instances:
-                        # 3. Add debug logging to see why it's skipping
-                        # print(f"Checking {instance.instance_id}: Now({now}) vs Expiry({instance.revert_time})")
-                        
-                        if now >= int(instance.revert_time):
-                            print(f"[Monitor] Killing expired instance {instance.instance_id}")
-                            delete_container(docker, instance.instance_id)
-                            db.session.delete(instance)
-                            db.session.commit()
-            except Exception as e:
-                print(f"[Docker Monitor Error]: {e}")
-                db.session.rollback()
-            
-            time.sleep(3)
+            delay = MONITOR_MAX_SLEEP
+            # Every worker process runs this thread, only the one holding the lock kills instances
+            if cache.add(MONITOR_LOCK_KEY, True, timeout=MONITOR_MAX_SLEEP * 10):
+                try:
+                    docker = DockerConfig.query.filter_by(id=1).first()
+                    if docker:
+                        next_expiry = kill_expired_instances(docker)
+                        if next_expiry is not None:
+                            delay = min(next_expiry, MONITOR_MAX_SLEEP)
+                except Exception as e:
+                    print(f"[Docker Monitor Error]: {e}")
+                    db.session.rollback()
+                finally:
+                    cache.delete(MONITOR_LOCK_KEY)
+                    db.session.remove()
+            time.sleep(delay)
 
 
 active_docker_namespace = Namespace("docker", description='Endpoint to retrieve User Docker Image Status')
@@ -1,6 +1,7 @@
 import traceback
 
-from CTFd.plugins.challenges import BaseChallenge, CHALLENGE_CLASSES, get_chal_class
+from CTFd.plugins.challenges import BaseChallenge, CHALLENGE_CLASSES, get_chal_class, get_compiled_flags, \
+    invalidate_compiled_flags
 from CTFd.plugins.flags import get_flag_class
 from CTFd.utils.user import get_ip
 from CTFd.utils.uploads import delete_file
@@ -13,14 +14,18 @@ from CTFd.utils.decorators import admins_only, authed_only, during_ctf_time_only
 from CTFd.utils.decorators.visibility import check_challenge_visibility, check_score_visibility
 from CTFd.utils.user import get_current_team
 from CTFd.utils.user import get_current_user
+from CTFd.utils.user import get_current_user_attrs, get_current_team_attrs
 from CTFd.utils.user import is_admin, authed
 from CTFd.utils.config import is_teams_mode
 from CTFd.api import CTFd_API_v1
 from CTFd.api.v1.scoreboard import ScoreboardDetail
 import CTFd.utils.scores
+from CTFd.cache.versions import get_cache_version, bump_cache_version
+from CTFd.cache import cache
 from CTFd.api.v1.challenges import ChallengeList, Challenge
 from flask_restx import Namespace, Resource
-from flask import request, Blueprint, jsonify, abort, render_template, url_for, redirect, session
+from flask import request, Blueprint, jsonify, abort, render_template, url_for, redirect, session, current_app, \
+    Response, stream_with_context, g
 # from flask_wtf import FlaskForm
 from wtforms import (
     FileField,
@@ -36,9 +41,23 @@ from wtforms import (
 # from wtforms import TextField, SubmitField, BooleanField, HiddenField, FileField, SelectMultipleField
 from wtforms.validators import DataRequired, ValidationError, InputRequired
 from werkzeug.utils import secure_filename
+from sqlalchemy import inspect, text
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.retry import Retry
+import socket
+import ssl
 import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import Queue, Empty, Full
 from CTFd.utils.dates import unix_time
+from CTFd.utils.events import ServerSentEvent
 from datetime import datetime
 import json
 import hashlib
@@ -70,20 +89,43 @@ class DockerChallengeTracker(db.Model):
         Docker Container Tracker. This model stores the users/teams active docker containers.
         """
     id = db.Column(db.Integer, primary_key=True)
-    team_id = db.Column("team_id", db.String(64), index=True)
-    user_id = db.Column("user_id", db.String(64), index=True)
-    docker_image = db.Column("docker_image", db.String(64), index=True)
+    # No foreign keys: a deleted user/team must not take the row with it while its container keeps running, the
+    # expiry thread removes both once the instance is due.
+    team_id = db.Column("team_id", db.Integer)
+    user_id = db.Column("user_id", db.Integer)
+    docker_image = db.Column("docker_image", db.String(64))
     timestamp = db.Column("timestamp", db.Integer, index=True)
     revert_time = db.Column("revert_time", db.Integer, index=True)
     instance_id = db.Column("instance_id", db.String(128), index=True)
-    ports = db.Column('ports', db.String(128), index=True)
-    host = db.Column('host', db.String(128), index=True)
-    challenge = db.Column('challenge', db.String(256), index=True)
+    ports = db.Column('ports', db.String(128))
+    host = db.Column('host', db.String(128))
+    challenge = db.Column('challenge', db.String(256))
+
+    # Every request of a player looks up their own instances, optionally of one image. These also serve the lookups
+    # on team_id/user_id alone. Ports, host and challenge are only ever read, so they carry no index.
+    __table_args__ = (
+        db.Index('docker_challenge_tracker_team_image', 'team_id', 'docker_image'),
+        db.Index('docker_challenge_tracker_user_image', 'user_id', 'docker_image'),
+    )
+
+
+class DockerWarmContainer(db.Model):
+    """
+        Docker Warm Pool. This model stores the containers that are already created and started for an image and are
+        waiting to be handed out to a user/team.
+        """
+    id = db.Column(db.Integer, primary_key=True)
+    docker_image = db.Column("docker_image", db.String(128), index=True)
+    instance_id = db.Column("instance_id", db.String(128))
+    ports = db.Column('ports', db.String(128))
+    timestamp = db.Column("timestamp", db.Integer)
+
 
 class DockerConfigForm(BaseForm):
     id = HiddenField()
     hostname = StringField(
-        "Docker Hostname", description="The Hostname/IP and Port of your Docker Server"
+        "Docker Hostname",
+        description="The Hostname/IP and Port of your Docker Server, or unix:///var/run/docker.sock for a local daemon"
     )
     tls_enabled = RadioField('TLS Enabled?')
     ca_cert = FileField('CA Cert')
@@ -142,7 +184,12 @@ def define_docker_admin(app):
                 b.repositories = None
             db.session.add(b)
             db.session.commit()
+            # New hostname or TLS material, make sure the next Docker call builds a fresh client and SSL context.
+            reset_docker_clients()
+            invalidate_docker_config()
             docker = DockerConfig.query.filter_by(id=1).first()
+        # The config page always shows (and re-caches) the live image catalog
+        invalidate_image_cache()
         try:
             repos = get_repositories(docker)
         except:
@@ -166,6 +213,54 @@ def define_docker_admin(app):
     app.register_blueprint(admin_docker_config)
 
 
+# Number of instances per page on the admin docker status page, when a page is asked for.
+STATUS_PER_PAGE = 50
+
+
+def get_docker_status_page(page=None, image=None, account=None, age=None):
+    """
+        Returns the tracked instances with the name of their user/team, loaded with a single joined query, and the
+        pagination. Without a page every instance is returned and the pagination is None.
+        Optionally filtered on the docker image, a part of the user/team name, and a minimum age in minutes.
+        """
+    if is_teams_mode():
+        account_model, account_column = Teams, DockerChallengeTracker.team_id
+    else:
+        account_model, account_column = Users, DockerChallengeTracker.user_id
+    query = db.session.query(DockerChallengeTracker, account_model.name).outerjoin(
+        account_model, account_model.id == account_column)
+    if image:
+        query = query.filter(DockerChallengeTracker.docker_image == image)
+    if account:
+        query = query.filter(account_model.name.ilike('%' + account + '%'))
+    if age:
+        query = query.filter(DockerChallengeTracker.timestamp <= unix_time(datetime.utcnow()) - age * 60)
+    query = query.order_by(DockerChallengeTracker.id.asc())
+    if page is None:
+        pagination = None
+        rows = query.all()
+    else:
+        pagination = query.paginate(page=page, per_page=STATUS_PER_PAGE, error_out=False)
+        rows = pagination.items
+    dockers = list()
+    for tracker, name in rows:
+        dockers.append({
+            'id': tracker.id,
+            # The status page shows the name of the user/team in place of its id
+            'team_id': name if is_teams_mode() else tracker.team_id,
+            'user_id': tracker.user_id if is_teams_mode() else name,
+            'account_id': tracker.team_id if is_teams_mode() else tracker.user_id,
+            'docker_image': tracker.docker_image,
+            'timestamp': tracker.timestamp,
+            'revert_time': tracker.revert_time,
+            'instance_id': tracker.instance_id,
+            'ports': tracker.ports,
+            'host': tracker.host,
+            'challenge': tracker.challenge,
+        })
+    return dockers, pagination
+
+
 def define_docker_status(app):
     admin_docker_status = Blueprint('admin_docker_status', __name__, template_folder='templates',
                                     static_folder='assets')
@@ -173,22 +268,89 @@ def define_docker_status(app):
     @admin_docker_status.route("/admin/docker_status", methods=["GET", "POST"])
     @admins_only
     def docker_admin():
-        docker_config = DockerConfig.query.filter_by(id=1).first()
-        docker_tracker = DockerChallengeTracker.query.all()
-        for i in docker_tracker:
-            if is_teams_mode():
-                name = Teams.query.filter_by(id=i.team_id).first()
-                i.team_id = name.name
-            else:
-                name = Users.query.filter_by(id=i.user_id).first()
-                i.user_id = name.name
-        return render_template("admin_docker_status.html", dockers=docker_tracker)
+        # The status page has no pager, so it lists every instance unless a page is asked for
+        page = request.args.get('page', type=int)
+        image = request.args.get('image')
+        account = request.args.get('account')
+        age = request.args.get('age', type=int)
+        dockers, pagination = get_docker_status_page(page=page, image=image, account=account, age=age)
+        if pagination is None:
+            meta = {'page': 1, 'next': None, 'prev': None, 'pages': 1, 'per_page': len(dockers),
+                    'total': len(dockers)}
+        else:
+            meta = {'page': pagination.page, 'next': pagination.next_num, 'prev': pagination.prev_num,
+                    'pages': pagination.pages, 'per_page': pagination.per_page, 'total': pagination.total}
+        # Used by the page to refresh the table without reloading
+        if request.args.get('format') == 'json':
+            return jsonify({
+                'success': True,
+                'data': dockers,
+                'meta': {
+                    'pagination': meta
+                }
+            })
+        return render_template("admin_docker_status.html", dockers=dockers, pages=meta['pages'],
+                               curr_page=meta['page'], total=meta['total'], image=image, account=account, age=age)
 
     app.register_blueprint(admin_docker_status)
 
 
+def define_docker_events(app):
+    docker_events = Blueprint('docker_events', __name__)
+
+    # Same stream as CTFd's /events, but on the channel of the current user/team. nginx serves /events/ unbuffered.
+    @docker_events.route("/events/docker")
+    @authed_only
+    def docker_event_stream():
+        session, tracker_filter = get_account_filter()
+        channel = get_account_channel(tracker_filter)
+
+        @stream_with_context
+        def gen():
+            for event in instance_events.subscribe(channel):
+                yield str(event)
+
+        return Response(gen(), mimetype="text/event-stream")
+
+    app.register_blueprint(docker_events)
+
+
 kill_container = Namespace("nuke", description='Endpoint to nuke containers')
 
+# Number of containers deleted at the same time when every instance is nuked.
+NUKE_WORKERS = 16
+
+
+def nuke_instances(docker, instances):
+    """
+        Deletes the containers of the given instances with a bounded pool of threads and removes their tracker rows in
+        a single statement. Yields the progress after every container.
+        """
+    removed = list()
+    total = len(instances)
+    try:
+        with ThreadPoolExecutor(max_workers=NUKE_WORKERS, thread_name_prefix='docker-nuke') as pool:
+            futures = {pool.submit(delete_container, docker, i.instance_id): i for i in instances}
+            for done, future in enumerate(as_completed(futures), 1):
+                instance = futures[future]
+                deleted = future.result()
+                if deleted:
+                    removed.append(instance)
+                yield {'instance_id': instance.instance_id, 'deleted': deleted, 'done': done, 'total': total}
+    finally:
+        # Rows of containers the daemon could not delete are kept, so the nuke can be retried
+        if removed:
+            ids = [i.id for i in removed]
+            ports = [i.ports for i in removed]
+            events = [(get_tracker_filter(i), {'docker_image': i.docker_image, 'instance_id': i.instance_id})
+                      for i in removed]
+            DockerChallengeTracker.query.filter(DockerChallengeTracker.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            for p in ports:
+                port_allocator.release_ports(p)
+            for tracker_filter, data in events:
+                publish_instance_event(tracker_filter, 'killed', data)
+
 
 @kill_container.route("", methods=['POST', 'GET'])
 class KillContainerAPI(Resource):
@@ -196,90 +358,496 @@ class KillContainerAPI(Resource):
     def get(self):
         container = request.args.get('container')
         full = request.args.get('all')
-        docker_config = DockerConfig.query.filter_by(id=1).first()
+        docker_config = get_docker_config()
         docker_tracker = DockerChallengeTracker.query.all()
         if full == "true":
-            for c in docker_tracker:
-                delete_container(docker_config, c.instance_id)
-                DockerChallengeTracker.query.filter_by(instance_id=c.instance_id).delete()
-                db.session.commit()
+            progress = nuke_instances(docker_config, docker_tracker)
+            if request.args.get('stream') == "true":
+                # One JSON line per container, so the admin page can show how far the teardown is
+                def generate():
+                    for p in progress:
+                        yield json.dumps(p) + "\n"
+                    yield json.dumps({'success': True}) + "\n"
+                return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                                headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'})
+            # Run the whole teardown before answering
+            list(progress)
 
         elif container != 'null' and container in [c.instance_id for c in docker_tracker]:
             delete_container(docker_config, container)
+            tracked = [c for c in docker_tracker if c.instance_id == container]
+            ports = [c.ports for c in tracked]
+            events = [(get_tracker_filter(c), {'docker_image': c.docker_image, 'instance_id': c.instance_id})
+                      for c in tracked]
             DockerChallengeTracker.query.filter_by(instance_id=container).delete()
             db.session.commit()
+            for p in ports:
+                port_allocator.release_ports(p)
+            for tracker_filter, data in events:
+                publish_instance_event(tracker_filter, 'killed', data)
 
         else:
             return False
         return True
 
 
+# The config row is read by nearly every request. Each process keeps a frozen copy of it, dropped when the admin form
+# saves through a version key in the CTFd cache, so every worker process notices.
+DOCKER_CONFIG_VERSION_KEY = 'docker_challenges_config_version'
+_docker_config = {'version': None, 'config': None}
+_docker_config_lock = threading.Lock()
+
+
+class DockerConfigSnapshot(object):
+    """
+        Read-only copy of the DockerConfig row, safe to share between requests and threads.
+        """
+    __slots__ = ('id', 'hostname', 'tls_enabled', 'ca_cert', 'client_cert', 'client_key', 'repositories')
+
+    def __init__(self, docker):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(docker, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The docker config snapshot is read-only, edit DockerConfig instead")
+
+
+def get_docker_config():
+    """
+        Returns a snapshot of the docker config, or None when it was never saved.
+        """
+    version = get_cache_version(DOCKER_CONFIG_VERSION_KEY)
+    with _docker_config_lock:
+        if _docker_config['version'] == version:
+            return _docker_config['config']
+    docker = DockerConfig.query.filter_by(id=1).first()
+    config = DockerConfigSnapshot(docker) if docker else None
+    with _docker_config_lock:
+        _docker_config['version'] = version
+        _docker_config['config'] = config
+    return config
+
+
+def invalidate_docker_config():
+    bump_cache_version(DOCKER_CONFIG_VERSION_KEY)
+
+
+# Docker Engine API client settings. Every start/stop used to open a brand new TCP+TLS connection per call,
+# so we keep one pooled, keep-alive session per Docker config and share it between all the helpers below.
+DOCKER_POOL_SIZE = 32
+DOCKER_TIMEOUT = (3.05, 30)  # (connect, read) in seconds
+# Connection errors are retried for every method, read/status errors only for idempotent ones so a
+# container create is never sent twice.
+DOCKER_RETRIES = Retry(total=3, connect=3, read=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                       allowed_methods=frozenset(['GET', 'DELETE']), raise_on_status=False)
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """
+        HTTPAdapter that hands a prebuilt ssl.SSLContext to its connection pools, so the Docker TLS material is
+        loaded once instead of from disk on every connection.
+        """
+
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super(SSLContextAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super(SSLContextAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super(SSLContextAdapter, self).proxy_manager_for(*args, **kwargs)
+
+
+class UnixSocketConnection(HTTPConnection):
+    """
+        urllib3 connection that speaks HTTP over the Docker daemon's Unix socket instead of TCP.
+        """
+
+    def __init__(self, socket_path, timeout=None):
+        super(UnixSocketConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path, maxsize=1):
+        super(UnixSocketConnectionPool, self).__init__('localhost', maxsize=maxsize)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixSocketConnection(self.socket_path, timeout=self.timeout.connect_timeout)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """
+        HTTPAdapter that sends every request to a single pooled Unix socket connection pool, for a Docker daemon
+        running on the same host as CTFd. No TCP or TLS is involved.
+        """
+
+    def __init__(self, socket_path, pool_maxsize=DOCKER_POOL_SIZE, **kwargs):
+        self.socket_path = socket_path
+        self.pool = UnixSocketConnectionPool(socket_path, maxsize=pool_maxsize)
+        super(UnixSocketAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_maxsize, **kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.pool
+
+    def get_connection(self, url, proxies=None):
+        return self.pool
+
+    def request_url(self, request, proxies):
+        return request.path_url
+
+    def close(self):
+        self.pool.close()
+        super(UnixSocketAdapter, self).close()
+
+
+def get_socket_path(hostname):
+    """
+        Returns the Unix socket path when the Docker hostname points at a local daemon, otherwise None.
+        Accepts both unix:///var/run/docker.sock and a bare /var/run/docker.sock.
+        """
+    hostname = str(hostname or '').strip()
+    if hostname.startswith('unix://'):
+        return hostname[len('unix://'):]
+    if hostname.startswith('/'):
+        return hostname
+    return None
+
+
+def get_docker_host(docker):
+    """
+        The host players should connect to for their instance.
+        """
+    # A local daemon publishes the ports on this very host, so hand out the address CTFd was reached on.
+    if get_socket_path(docker.hostname):
+        return request.host.split(':')[0]
+    return str(docker.hostname).split(':')[0]
+
+
+class DockerClient(object):
+    """
+        Long-lived Docker Engine API client. Wraps a pooled requests.Session so connections (and TLS handshakes)
+        are reused across calls instead of being made for every request.
+        """
+
+    def __init__(self, docker):
+        self.tls = docker.tls_enabled
+        prefix = 'https' if self.tls else 'http'
+        self.base_url = '%s://%s' % (prefix, docker.hostname)
+        self.session = requests.Session()
+        socket_path = get_socket_path(docker.hostname)
+        if socket_path:
+            self.tls = False
+            self.base_url = 'http://localhost'
+            adapter = UnixSocketAdapter(socket_path, pool_maxsize=DOCKER_POOL_SIZE, max_retries=DOCKER_RETRIES)
+        elif self.tls:
+            adapter = SSLContextAdapter(get_ssl_context(docker), pool_connections=1, pool_maxsize=DOCKER_POOL_SIZE,
+                                        max_retries=DOCKER_RETRIES)
+        else:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DOCKER_POOL_SIZE, max_retries=DOCKER_RETRIES)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', DOCKER_TIMEOUT)
+        return self.session.request(method, self.base_url + url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_docker_clients = dict()
+_docker_clients_lock = threading.Lock()
+
+
+def get_docker_client(docker):
+    """
+        Returns the shared DockerClient for this Docker config, building a new one when the config changed.
+        """
+    key = (docker.hostname, docker.tls_enabled, get_cert_hash(docker))
+    client = _docker_clients.get(key)
+    if client is None:
+        with _docker_clients_lock:
+            client = _docker_clients.get(key)
+            if client is None:
+                # The config was changed from the admin page, so the old connections are no longer useful.
+                for old in _docker_clients.values():
+                    old.close()
+                _docker_clients.clear()
+                client = DockerClient(docker)
+                _docker_clients[key] = client
+    return client
+
+
+def reset_docker_clients():
+    with _docker_clients_lock:
+        for old in _docker_clients.values():
+            old.close()
+        _docker_clients.clear()
+    _ssl_contexts.clear()
+
+
 def do_request(docker, url, headers=None, method='GET'):
-    tls = docker.tls_enabled
-    prefix = 'https' if tls else 'http'
-    host = docker.hostname
-    URL_TEMPLATE = '%s://%s' % (prefix, host)
+    client = get_docker_client(docker)
     try:
-        if tls:
-            cert, verify = get_client_cert(docker)
-            if (method == 'GET'):
-                r = requests.get(url=f"%s{url}" % URL_TEMPLATE, cert=cert, verify=verify, headers=headers)
-            elif (method == 'DELETE'):
-                r = requests.delete(url=f"%s{url}" % URL_TEMPLATE, cert=cert, verify=verify, headers=headers)
-            # Clean up the cert files:
-            for file_path in [*cert, verify]:
-                if file_path:
-                    Path(file_path).unlink(missing_ok=True)
-        else:
-            if (method == 'GET'):
-                r = requests.get(url=f"%s{url}" % URL_TEMPLATE, headers=headers)
-            elif (method == 'DELETE'):
-                r = requests.delete(url=f"%s{url}" % URL_TEMPLATE, headers=headers)
+        if (method == 'GET'):
+            r = client.get(url, headers=headers)
+        elif (method == 'DELETE'):
+            r = client.delete(url, headers=headers)
     except:
         traceback.print_exc()
         r = []
     return r
 
 
-def get_client_cert(docker):
-    # this can be done more efficiently, but works for now.
-    try:
-        ca = docker.ca_cert
-        client = docker.client_cert
-        ckey = docker.client_key
-        ca_file = tempfile.NamedTemporaryFile(delete=False)
-        ca_file.write(ca.encode())
-        ca_file.seek(0)
-        client_file = tempfile.NamedTemporaryFile(delete=False)
-        client_file.write(client.encode())
-        client_file.seek(0)
-        key_file = tempfile.NamedTemporaryFile(delete=False)
-        key_file.write(ckey.encode())
-        key_file.seek(0)
-        CERT = (client_file.name, key_file.name)
-    except:
-        traceback.print_exc()
-        CERT = None
-    return CERT, ca_file.name
+def _cert_text(value):
+    # Right after the admin form is saved the columns still hold the uploaded bytes.
+    if isinstance(value, bytes):
+        return value.decode()
+    return value or ''
+
+
+def get_cert_hash(docker):
+    """
+        Hash of the TLS material of a Docker config. Used as the key of the SSL context and client caches.
+        """
+    h = hashlib.sha256()
+    for value in (docker.ca_cert, docker.client_cert, docker.client_key):
+        h.update(_cert_text(value).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+_ssl_contexts = dict()
+
+
+def get_ssl_context(docker):
+    """
+        Returns an ssl.SSLContext holding the CA, client cert and key of this Docker config. It is built once per set
+        of cert columns and kept in memory, instead of writing the material to temporary files on every request.
+        """
+    key = get_cert_hash(docker)
+    context = _ssl_contexts.get(key)
+    if context is None:
+        context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cadata=_cert_text(docker.ca_cert))
+        # load_cert_chain() only accepts paths, so the pair touches the disk once while the context is built.
+        with tempfile.TemporaryDirectory() as tmp:
+            cert_file = Path(tmp) / 'cert.pem'
+            key_file = Path(tmp) / 'key.pem'
+            cert_file.write_text(_cert_text(docker.client_cert))
+            key_file.touch(mode=0o600)
+            key_file.write_text(_cert_text(docker.client_key))
+            context.load_cert_chain(certfile=str(cert_file), keyfile=str(key_file))
+        _ssl_contexts.clear()
+        _ssl_contexts[key] = context
+    return context
+
+
+# Image metadata is shared by all workers through the CTFd cache. Images only change a few times per event,
+# so the catalog and the exposed ports of each image are kept until they expire or the admin config page is opened.
+IMAGE_CACHE_TIMEOUT = 300
+IMAGE_CACHE_KEY = 'docker_challenges_images'
+IMAGE_PORTS_CACHE_KEY = 'docker_challenges_image_ports'
+
+
+def invalidate_image_cache():
+    cache.delete(IMAGE_CACHE_KEY)
+    cache.delete(IMAGE_PORTS_CACHE_KEY)
+
+
+def get_images(docker):
+    """
+        Returns the RepoTags of every image on the Docker Server, served from the cache when possible.
+        """
+    images = cache.get(IMAGE_CACHE_KEY)
+    if images is None:
+        r = do_request(docker, '/images/json?all=1')
+        # Only the tags are needed, and newer Docker versions send null instead of [] for untagged images
+        images = [i.get('RepoTags') or [] for i in r.json()]
+        cache.set(IMAGE_CACHE_KEY, images, timeout=IMAGE_CACHE_TIMEOUT)
+    return images
 
 
 # For the Docker Config Page. Gets the Current Repositories available on the Docker Server.
 def get_repositories(docker, tags=False, repos=False):
-    r = do_request(docker, '/images/json?all=1')
     result = list()
-    for i in r.json():
-        if not i['RepoTags'] == []:
-            if not i['RepoTags'][0].split(':')[0] == '<none>':
+    for repo_tags in get_images(docker):
+        if not repo_tags == []:
+            if not repo_tags[0].split(':')[0] == '<none>':
                 if repos:
-                    if not i['RepoTags'][0].split(':')[0] in repos:
+                    if not repo_tags[0].split(':')[0] in repos:
                         continue
                 if not tags:
-                    result.append(i['RepoTags'][0].split(':')[0])
+                    result.append(repo_tags[0].split(':')[0])
                 else:
-                    result.append(i['RepoTags'][0])
+                    result.append(repo_tags[0])
     return list(set(result))
 
 
+# Host port range handed out to challenge instances.
+PORT_RANGE_START = 30000
+PORT_RANGE_END = 60000
+# How often the allocator is checked against the ports actually published on the Docker daemon.
+PORT_RECONCILE_INTERVAL = 60
+
+
+class PortAllocator(object):
+    """
+        Host port allocator for challenge instances. Keeps one bit per port of the challenge range (under 4KB for the
+        default range), so allocating and releasing a port does not need the container list of the daemon.
+
+        The DockerChallengeTracker.ports column stays the source of truth: the bitmap is rebuilt from it when the
+        plugin loads, and reconcile_ports() merges in the ports published on the daemon in the background.
+        """
+
+    def __init__(self, start=PORT_RANGE_START, end=PORT_RANGE_END):
+        self.start = start
+        self.end = end
+        self.size = end - start
+        self.lock = threading.Lock()
+        self.recent = None
+        self.rebuild([])
+
+    def _index(self, port):
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            return None
+        if self.start <= port < self.end:
+            return port - self.start
+        return None
+
+    def _is_used(self, i):
+        return self.bitmap[i >> 3] & (1 << (i & 7))
+
+    def _mark(self, i):
+        if not self._is_used(i):
+            self.bitmap[i >> 3] |= 1 << (i & 7)
+            self.free -= 1
+
+    def _unmark(self, i):
+        if self._is_used(i):
+            self.bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+            self.free += 1
+
+    def rebuild(self, used_ports):
+        """
+            Resets the bitmap so that exactly the given ports are in use.
+            """
+        with self.lock:
+            self.bitmap = bytearray((self.size + 7) // 8)
+            # Pad the last byte so the bits past the end of the range are never handed out
+            for i in range(self.size, len(self.bitmap) * 8):
+                self.bitmap[i >> 3] |= 1 << (i & 7)
+            self.free = self.size
+            for port in used_ports:
+                i = self._index(port)
+                if i is not None:
+                    self._mark(i)
+            # Start from a random spot so restarts don't hand out the same ports in the same order
+            self.cursor = random.randrange(self.size)
+
+    def allocate(self):
+        with self.lock:
+            if self.free == 0:
+                raise RuntimeError("No free host ports left in range %s-%s" % (self.start, self.end))
+            i = self.cursor
+            while True:
+                if i >= self.size:
+                    i = 0
+                if self.bitmap[i >> 3] == 0xFF:
+                    # Skip the whole byte, all 8 ports are taken
+                    i = ((i >> 3) + 1) << 3
+                elif self._is_used(i):
+                    i += 1
+                else:
+                    break
+            self._mark(i)
+            self.cursor = i + 1
+            if self.recent is not None:
+                self.recent.add(i)
+            return self.start + i
+
+    def release(self, port):
+        i = self._index(port)
+        if i is not None:
+            with self.lock:
+                self._unmark(i)
+
+    def release_ports(self, ports):
+        """
+            Releases the ports of a tracker row, given as its comma separated ports column.
+            """
+        for port in str(ports or '').split(','):
+            self.release(port.split('/')[0])
+
+    def begin_reconcile(self):
+        with self.lock:
+            self.recent = set()
+
+    def finish_reconcile(self, used_ports):
+        """
+            Replaces the bitmap with the ports in use according to the tracker table and the daemon, keeping the ports
+            that were handed out while those were being fetched.
+            """
+        with self.lock:
+            recent = self.recent or set()
+            self.recent = None
+        self.rebuild(list(used_ports) + [self.start + i for i in recent])
+
+
+port_allocator = PortAllocator()
+
+
+def get_tracked_ports():
+    used = set()
+    tracked = db.session.query(DockerChallengeTracker.ports).union_all(db.session.query(DockerWarmContainer.ports))
+    for (ports,) in tracked:
+        for port in str(ports or '').split(','):
+            try:
+                used.add(int(port.split('/')[0]))
+            except ValueError:
+                continue
+    return used
+
+
+def reconcile_ports(app):
+    with app.app_context():
+        while True:
+            time.sleep(PORT_RECONCILE_INTERVAL)
+            try:
+                docker = get_docker_config()
+                if docker:
+                    port_allocator.begin_reconcile()
+                    used = get_tracked_ports()
+                    used.update(get_unavailable_ports(docker))
+                    port_allocator.finish_reconcile(used)
+            except Exception as e:
+                print(f"[Docker Port Reconcile Error]: {e}")
+            finally:
+                db.session.remove()
+
+
 def get_unavailable_ports(docker):
     r = do_request(docker, '/containers/json?all=1')
     result = list()
@@ -296,71 +864,543 @@ def get_unavailable_ports(docker):
 
 
 def get_required_ports(docker, image):
-    r = do_request(docker, f'/images/{image}/json?all=1')
-    result = r.json()['Config']['ExposedPorts'].keys()
-    return result
+    image_ports = cache.get(IMAGE_PORTS_CACHE_KEY) or dict()
+    if image not in image_ports:
+        r = do_request(docker, f'/images/{image}/json?all=1')
+        image_ports[image] = list(r.json()['Config']['ExposedPorts'].keys())
+        cache.set(IMAGE_PORTS_CACHE_KEY, image_ports, timeout=IMAGE_CACHE_TIMEOUT)
+    return image_ports[image]
 
 
-def create_container(docker, image, team, portbl):
-    tls = docker.tls_enabled
-    CERT = None
-    if not tls:
-        prefix = 'http'
-    else:
-        prefix = 'https'
-    host = docker.hostname
-    URL_TEMPLATE = '%s://%s' % (prefix, host)
+def create_container(docker, image, team):
+    client = get_docker_client(docker)
     needed_ports = get_required_ports(docker, image)
     team = hashlib.md5(team.encode("utf-8")).hexdigest()[:10]
     container_name = "%s_%s" % (image.split(':')[1], team)
     assigned_ports = dict()
-    for i in needed_ports:
-        while True:
-            assigned_port = random.choice(range(30000, 60000))  # Challenges port range
-			# --- THE DUPLICATE CHECK ---
-			# 'portbl' is the "Port Blacklist" (all ports currently taken in the DB). If the random port is NOT in the blacklist, it's safe to use
-            if assigned_port not in portbl:
-                assigned_ports['%s/tcp' % assigned_port] = {}
-                break
-    ports = dict()
-    bindings = dict()
-    tmp_ports = list(assigned_ports.keys())
-    # Map the Internal Container Port to the Randomly Assigned Host Port
-    for i in needed_ports:
-        ports[i] = {}
-        # Pop a unique host port and bind it to the challenge's required port
-        bindings[i] = [{"HostPort": tmp_ports.pop()}]
-    headers = {'Content-Type': "application/json"}
-    # Send the configuration to the Docker API to create and start the container
-    data = json.dumps({"Image": image, "ExposedPorts": ports, "HostConfig": {"PortBindings": bindings}})
-    # Code below sends the POST request to Docker
-    if tls:
-        cert, verify = get_client_cert(docker)
-        r = requests.post(url="%s/containers/create?name=%s" % (URL_TEMPLATE, container_name), cert=cert,
-                      verify=verify, data=data, headers=headers)
-        result = r.json()
-        s = requests.post(url="%s/containers/%s/start" % (URL_TEMPLATE, result['Id']), cert=cert, verify=verify,
-                          headers=headers)
-        # Clean up the cert files:
-        for file_path in [*cert, verify]:
-            if file_path:
-                Path(file_path).unlink(missing_ok=True)
-
-    else:
-        r = requests.post(url="%s/containers/create?name=%s" % (URL_TEMPLATE, container_name),
-                          data=data, headers=headers)
-        print(r.request.method, r.request.url, r.request.body)
+    allocated = list()
+    try:
+        for i in needed_ports:
+            # The allocator only hands out ports that are not taken by another instance
+            assigned_port = port_allocator.allocate()
+            allocated.append(assigned_port)
+            assigned_ports['%s/tcp' % assigned_port] = {}
+        ports = dict()
+        bindings = dict()
+        tmp_ports = list(assigned_ports.keys())
+        # Map the Internal Container Port to the Randomly Assigned Host Port
+        for i in needed_ports:
+            ports[i] = {}
+            # Pop a unique host port and bind it to the challenge's required port
+            bindings[i] = [{"HostPort": tmp_ports.pop()}]
+        headers = {'Content-Type': "application/json"}
+        # Send the configuration to the Docker API to create and start the container
+        data = json.dumps({"Image": image, "ExposedPorts": ports, "HostConfig": {"PortBindings": bindings}})
+        # Code below sends the POST request to Docker
+        r = client.post("/containers/create?name=%s" % container_name, data=data, headers=headers)
         result = r.json()
-        print(result)
         # name conflicts are not handled properly
-        s = requests.post(url="%s/containers/%s/start" % (URL_TEMPLATE, result['Id']), headers=headers)
+        s = client.post("/containers/%s/start" % result['Id'], headers=headers)
+        if s.status_code >= 400:
+            client.delete("/containers/%s?force=true" % result['Id'])
+            raise RuntimeError("Could not start container %s: %s" % (container_name, s.text))
+    except Exception:
+        # Nothing will track these ports, give them back now instead of at the next reconcile
+        for port in allocated:
+            port_allocator.release(port)
+        raise
     return result, data
 
 
 def delete_container(docker, instance_id):
     headers = {'Content-Type': "application/json"}
-    do_request(docker, f'/containers/{instance_id}?force=true', headers=headers, method='DELETE')
-    return True
+    r = do_request(docker, f'/containers/{instance_id}?force=true', headers=headers, method='DELETE')
+    if r == []:
+        # The daemon could not be reached
+        return False
+    # 404 means the container is already gone
+    return r.status_code in (204, 404)
+
+
+# How often the warm pools are checked when nothing wakes the worker up.
+WARM_POOL_INTERVAL = 30
+WARM_POOL_LOCK_KEY = 'docker_challenges_warm_pool_lock'
+warm_pool_event = threading.Event()
+
+
+def get_warm_pool_sizes():
+    """
+        Returns the number of warm containers wanted per docker image.
+        """
+    sizes = dict()
+    challenges = DockerChallenge.query.filter(DockerChallenge.warm_pool_size > 0)
+    for challenge in challenges:
+        sizes[challenge.docker_image] = max(sizes.get(challenge.docker_image, 0), int(challenge.warm_pool_size))
+    return sizes
+
+
+def fill_warm_pools(docker):
+    """
+        Creates the missing warm containers of every pool and removes the ones no challenge wants anymore.
+        """
+    sizes = get_warm_pool_sizes()
+    pooled = dict()
+    for warm in DockerWarmContainer.query.order_by(DockerWarmContainer.id.asc()):
+        pooled.setdefault(warm.docker_image, []).append(warm)
+    for image, warm_containers in pooled.items():
+        try:
+            for warm in warm_containers[sizes.get(image, 0):]:
+                instance_id, ports = warm.instance_id, warm.ports
+                # Same as handing it out: whoever removes the row owns the container
+                removed = DockerWarmContainer.query.filter_by(id=warm.id).delete(synchronize_session=False)
+                db.session.commit()
+                if removed:
+                    delete_container(docker, instance_id)
+                    port_allocator.release_ports(ports)
+        except Exception as e:
+            print(f"[Docker Warm Pool Error] {image}: {e}")
+            db.session.rollback()
+    for image, size in sizes.items():
+        # One image that fails to start must not keep the other pools empty
+        try:
+            for _ in range(size - len(pooled.get(image, []))):
+                create = create_container(docker, image, uuid.uuid4().hex)
+                ports = json.loads(create[1])['HostConfig']['PortBindings'].values()
+                db.session.add(DockerWarmContainer(
+                    docker_image=image,
+                    instance_id=create[0]['Id'],
+                    ports=','.join([p[0]['HostPort'] for p in ports]),
+                    timestamp=unix_time(datetime.utcnow()),
+                ))
+                db.session.commit()
+        except Exception as e:
+            print(f"[Docker Warm Pool Error] {image}: {e}")
+            db.session.rollback()
+
+
+def claim_warm_container(image):
+    """
+        Takes a ready container out of the warm pool of this image. Returns its (instance_id, ports), or None when the
+        pool is empty.
+        """
+    warm_containers = DockerWarmContainer.query.filter_by(docker_image=image).order_by(DockerWarmContainer.id.asc())
+    for warm in warm_containers.limit(5).all():
+        instance_id, ports = warm.instance_id, warm.ports
+        # Several requests can race for the same row, only the one that deletes it gets the container
+        claimed = DockerWarmContainer.query.filter_by(id=warm.id).delete(synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            warm_pool_event.set()
+            return instance_id, ports
+    return None
+
+
+def refill_warm_pools(app):
+    with app.app_context():
+        while True:
+            warm_pool_event.wait(WARM_POOL_INTERVAL)
+            warm_pool_event.clear()
+            # Only one worker process fills the pools at a time
+            if not cache.add(WARM_POOL_LOCK_KEY, True, timeout=WARM_POOL_INTERVAL * 10):
+                continue
+            try:
+                docker = get_docker_config()
+                if docker:
+                    fill_warm_pools(docker)
+            except Exception as e:
+                print(f"[Docker Warm Pool Error]: {e}")
+                db.session.rollback()
+            finally:
+                cache.delete(WARM_POOL_LOCK_KEY)
+                db.session.remove()
+
+
+# Instance events. Lifecycle changes of an instance are pushed to its user/team over the CTFd event stream
+# (/events/docker), so the challenge page does not have to poll /api/v1/docker_status.
+def get_account_channel(tracker_filter):
+    account = list(tracker_filter.items())[0]
+    return 'docker_challenges_%s_%s' % account
+
+
+# Seconds between keep-alive pings on an idle stream, and events kept for a stream that stopped reading.
+EVENT_PING_INTERVAL = 5
+EVENT_QUEUE_SIZE = 64
+
+
+class InstanceEventBroker(object):
+    """
+        Delivers instance events to the /events/docker streams of a user/team. CTFd's event managers can't carry the
+        per-account channels: RedisEventManager only forwards its "ctf" channel, and EventManager queues every message on
+        every connected client. With Redis every stream subscribes to its own channel, otherwise the events go through
+        bounded queues in this process.
+        """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queues = defaultdict(set)
+
+    @staticmethod
+    def get_redis():
+        # Same client CTFd's RedisEventManager publishes with, None for the in-memory caches
+        return getattr(cache.cache, '_write_client', None)
+
+    def publish(self, channel, type, data):
+        message = json.dumps(ServerSentEvent(data, type=type).to_dict())
+        redis = self.get_redis()
+        if redis is not None:
+            redis.publish(channel, message)
+            return
+        with self.lock:
+            queues = list(self.queues.get(channel, ()))
+        for q in queues:
+            try:
+                q.put_nowait(message)
+            except Full:
+                # The stream is gone or stuck, it refetches the status when it reconnects
+                pass
+
+    def subscribe(self, channel):
+        """
+            Yields the events of a channel as they come, with a ping when there was nothing for EVENT_PING_INTERVAL.
+            """
+        redis = self.get_redis()
+        messages = self.listen_redis(redis, channel) if redis is not None else self.listen_local(channel)
+        try:
+            for message in messages:
+                if message is None:
+                    yield ServerSentEvent(data="", type="ping")
+                else:
+                    yield ServerSentEvent(**json.loads(message))
+        finally:
+            # Drops the subscription as soon as the browser disconnects
+            messages.close()
+
+    @staticmethod
+    def listen_redis(redis, channel):
+        pubsub = redis.pubsub()
+        pubsub.subscribe(channel)
+        try:
+            while True:
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=EVENT_PING_INTERVAL)
+                if message is None:
+                    yield None
+                elif message['type'] == 'message':
+                    yield message['data']
+        finally:
+            pubsub.close()
+
+    def listen_local(self, channel):
+        q = Queue(maxsize=EVENT_QUEUE_SIZE)
+        with self.lock:
+            self.queues[channel].add(q)
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=EVENT_PING_INTERVAL)
+                except Empty:
+                    yield None
+        finally:
+            self.unsubscribe(channel, q)
+
+    def unsubscribe(self, channel, q):
+        with self.lock:
+            self.queues[channel].discard(q)
+            if not self.queues[channel]:
+                del self.queues[channel]
+
+
+instance_events = InstanceEventBroker()
+
+
+def get_tracker_filter(tracker):
+    """
+        Returns the filter that selects the rows of the user/team owning this tracker row.
+        """
+    if tracker.team_id is not None:
+        return {'team_id': tracker.team_id}
+    return {'user_id': tracker.user_id}
+
+
+def get_instance_data(tracker, host=None):
+    return {
+        'id': tracker.id,
+        'team_id': tracker.team_id,
+        'user_id': tracker.user_id,
+        'docker_image': tracker.docker_image,
+        'timestamp': tracker.timestamp,
+        'revert_time': tracker.revert_time,
+        'instance_id': tracker.instance_id,
+        'ports': tracker.ports.split(','),
+        'host': host or tracker.host,
+    }
+
+
+# Every change to the instances or jobs of a user/team replaces its status version, which /api/v1/docker_status
+# serves as ETag.
+STATUS_VERSION_TIMEOUT = 3600
+
+
+def get_account_version_key(tracker_filter):
+    account = list(tracker_filter.items())[0]
+    return 'docker_challenges_version_%s_%s' % account
+
+
+def get_account_version(tracker_filter):
+    return get_cache_version(get_account_version_key(tracker_filter), timeout=STATUS_VERSION_TIMEOUT)
+
+
+def bump_account_version(tracker_filter):
+    bump_cache_version(get_account_version_key(tracker_filter), timeout=STATUS_VERSION_TIMEOUT)
+
+
+def publish_instance_event(tracker_filter, type, data):
+    """
+        Publishes one of the 'provisioning', 'ready', 'failed', 'stopped', 'expired' or 'killed' events to a user/team.
+        """
+    bump_account_version(tracker_filter)
+    try:
+        instance_events.publish(get_account_channel(tracker_filter), type, data)
+    except Exception:
+        # Clients still get the state from /api/v1/docker_status when they open the challenge
+        traceback.print_exc()
+
+
+# Instance expiry. Expired instances are looked up through the revert_time index and the reaper sleeps until the next
+# one is due. Instances started by other worker processes are not known here, so it never sleeps longer than
+# EXPIRY_MAX_SLEEP (well below the 300 seconds an instance lives).
+EXPIRY_MAX_SLEEP = 30
+EXPIRY_RETRY_DELAY = 10
+EXPIRY_LOCK_KEY = 'docker_challenges_expiry_lock'
+# Instances older than this are removed whatever their revert_time says
+STALE_INSTANCE_AGE = 7200
+expiry_event = threading.Event()
+
+
+def reap_expired_instances(docker):
+    """
+        Deletes every instance whose revert_time has passed, or that is older than STALE_INSTANCE_AGE, and returns the
+        number of seconds until the next one expires (None when nothing is tracked). Containers the daemon failed to
+        remove are kept and retried later.
+        """
+    now = unix_time(datetime.utcnow())
+    expired = DockerChallengeTracker.query.filter(db.or_(
+        DockerChallengeTracker.revert_time <= now,
+        DockerChallengeTracker.timestamp <= now - STALE_INSTANCE_AGE
+    )).all()
+    removed = list()
+    failed = False
+    for instance in expired:
+        if delete_container(docker, instance.instance_id):
+            removed.append(instance)
+        else:
+            print(f"[Docker Expiry] Could not delete expired instance {instance.instance_id}, retrying later")
+            failed = True
+    if removed:
+        print(f"[Docker Expiry] Killed {len(removed)} expired instance(s)")
+        ids = [i.id for i in removed]
+        ports = [i.ports for i in removed]
+        events = [(get_tracker_filter(i), {'docker_image': i.docker_image, 'instance_id': i.instance_id}) for i in removed]
+        DockerChallengeTracker.query.filter(DockerChallengeTracker.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        for p in ports:
+            port_allocator.release_ports(p)
+        for tracker_filter, data in events:
+            publish_instance_event(tracker_filter, 'expired', data)
+    if failed:
+        return EXPIRY_RETRY_DELAY
+    next_expiry = db.session.query(db.func.min(DockerChallengeTracker.revert_time)).scalar()
+    if next_expiry is None:
+        return None
+    return max(int(next_expiry) - now, 1)
+
+
+def expire_instances(app):
+    with app.app_context():
+        while True:
+            delay = EXPIRY_MAX_SLEEP
+            # Only one worker process reaps at a time, the others just check again later
+            if cache.add(EXPIRY_LOCK_KEY, True, timeout=EXPIRY_MAX_SLEEP * 10):
+                try:
+                    docker = get_docker_config()
+                    if docker:
+                        next_expiry = reap_expired_instances(docker)
+                        if next_expiry is not None:
+                            delay = min(next_expiry, EXPIRY_MAX_SLEEP)
+                except Exception as e:
+                    print(f"[Docker Expiry Error]: {e}")
+                    db.session.rollback()
+                finally:
+                    cache.delete(EXPIRY_LOCK_KEY)
+                    db.session.remove()
+            expiry_event.wait(delay)
+            expiry_event.clear()
+
+
+# Instance provisioning. Start/stop/revert requests are turned into jobs that a bounded pool of threads runs against
+# the Docker daemon, so the web workers never wait on it. Job states are kept in the CTFd cache so every worker can
+# report them.
+PROVISION_WORKERS = 8
+JOB_TIMEOUT = 3600
+# A job still pending/running after this long was lost (e.g. the worker restarted), so it no longer blocks the account
+JOB_DEADLINE = 300
+JOB_ACTIVE_STATES = ('pending', 'running')
+provisioning_pool = ThreadPoolExecutor(max_workers=PROVISION_WORKERS, thread_name_prefix='docker-provision')
+
+
+def get_account_filter():
+    """
+        Returns the current user/team and the filter that selects its rows in DockerChallengeTracker.
+        """
+    if is_teams_mode():
+        session = get_current_team_attrs()
+        return session, {'team_id': session.id}
+    session = get_current_user_attrs()
+    return session, {'user_id': session.id}
+
+
+def get_account_job_key(tracker_filter):
+    account = list(tracker_filter.items())[0]
+    return 'docker_challenges_job_%s_%s' % account
+
+
+def get_account_slot_key(tracker_filter):
+    account = list(tracker_filter.items())[0]
+    return 'docker_challenges_job_slot_%s_%s' % account
+
+
+def claim_job_slot(tracker_filter):
+    """
+        Atomically reserves the single provisioning slot of a user/team. Returns False if another request holds it.
+        The slot expires by itself after JOB_DEADLINE in case its job is lost.
+        """
+    return cache.add(get_account_slot_key(tracker_filter), True, timeout=JOB_DEADLINE)
+
+
+def release_job_slot(tracker_filter):
+    cache.delete(get_account_slot_key(tracker_filter))
+
+
+def save_job(job, tracker_filter):
+    cache.set(get_account_job_key(tracker_filter), job, timeout=JOB_TIMEOUT)
+    bump_account_version(tracker_filter)
+
+
+def get_account_job(tracker_filter):
+    """
+        Returns the last provisioning job of a user/team, or None.
+        """
+    job = cache.get(get_account_job_key(tracker_filter))
+    if job and job['status'] in JOB_ACTIVE_STATES and \
+            unix_time(datetime.utcnow()) - job.get('started', 0) > JOB_DEADLINE:
+        # Nothing is working on it anymore, report it as failed so the user can try again
+        job['status'] = 'failed'
+        job['message'] = "Your challenge instance request timed out. Please try again."
+        save_job(job, tracker_filter)
+    return job
+
+
+def stop_instance(docker, tracker_filter, image):
+    """
+        Deletes the instances of a user/team for an image. Containers the daemon failed to remove keep their tracker
+        row and ports, so they are retried by the expiry thread, and the job fails.
+        """
+    tracked = DockerChallengeTracker.query.filter_by(**tracker_filter).filter_by(docker_image=image).all()
+    removed = [i for i in tracked if delete_container(docker, i.instance_id)]
+    # Read before the commit, the deleted rows can't be loaded afterwards
+    ids = [i.id for i in removed]
+    ports = [i.ports for i in removed]
+    if ids:
+        DockerChallengeTracker.query.filter(DockerChallengeTracker.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+    for p in ports:
+        port_allocator.release_ports(p)
+    if len(removed) < len(tracked):
+        raise RuntimeError("Could not delete %d instance(s) of %s" % (len(tracked) - len(removed), image))
+
+
+def start_instance(docker, tracker_filter, image, challenge, account_name, host, warm=None):
+    # Hand out a pre-started container when this image has a warm pool, otherwise create one now.
+    if warm is None:
+        warm = claim_warm_container(image)
+    if warm:
+        instance_id, instance_ports = warm
+    else:
+        create = create_container(docker, image, account_name)
+        ports = json.loads(create[1])['HostConfig']['PortBindings'].values()
+        instance_id = create[0]['Id']
+        instance_ports = ','.join([p[0]['HostPort'] for p in ports])
+    entry = DockerChallengeTracker(
+        team_id=tracker_filter.get('team_id'),
+        user_id=tracker_filter.get('user_id'),
+        docker_image=image,
+        timestamp=unix_time(datetime.utcnow()),
+        revert_time=unix_time(datetime.utcnow()) + 300,
+        instance_id=instance_id,
+        ports=instance_ports,
+        host=host,
+        challenge=challenge
+    )
+    try:
+        db.session.add(entry)
+        db.session.commit()
+    except Exception:
+        # The container is no longer in the warm pool and has no tracker row, so nothing else would remove it
+        db.session.rollback()
+        if delete_container(docker, instance_id):
+            port_allocator.release_ports(instance_ports)
+        raise
+    publish_instance_event(tracker_filter, 'ready', dict(get_instance_data(entry), status='ready'))
+
+
+def run_job(app, job, tracker_filter, account_name, host):
+    with app.app_context():
+        try:
+            job['status'] = 'running'
+            save_job(job, tracker_filter)
+            docker = get_docker_config()
+            if job['action'] in ('stop', 'revert'):
+                stop_instance(docker, tracker_filter, job['docker_image'])
+            if job['action'] == 'stop':
+                publish_instance_event(tracker_filter, 'stopped', {'docker_image': job['docker_image']})
+            if job['action'] in ('start', 'revert'):
+                start_instance(docker, tracker_filter, job['docker_image'], job['challenge'], account_name, host)
+            job['status'] = 'done'
+        except Exception:
+            traceback.print_exc()
+            db.session.rollback()
+            job['status'] = 'failed'
+            job['message'] = "Something went wrong while preparing your challenge instance. Please try again."
+            publish_instance_event(tracker_filter, 'failed', {
+                'docker_image': job['docker_image'],
+                'status': job['status'],
+                'message': job['message']
+            })
+        finally:
+            save_job(job, tracker_filter)
+            release_job_slot(tracker_filter)
+            db.session.remove()
+
+
+def enqueue_job(action, tracker_filter, image, challenge, account_name, host):
+    """
+        Queues a start/stop/revert of a challenge instance and returns the job right away, or None when the user/team
+        already has one in progress.
+        """
+    if not claim_job_slot(tracker_filter):
+        return None
+    job = {
+        'id': uuid.uuid4().hex,
+        'action': action,
+        'status': 'pending',
+        'docker_image': image,
+        'challenge': challenge,
+        'message': None,
+        'started': unix_time(datetime.utcnow()),
+    }
+    save_job(job, tracker_filter)
+    publish_instance_event(tracker_filter, 'provisioning', {'docker_image': image, 'status': job['status']})
+    provisioning_pool.submit(run_job, current_app._get_current_object(), dict(job), tracker_filter, account_name, host)
+    return job
 
 
 class DockerChallengeType(BaseChallenge):
@@ -417,6 +1457,7 @@ class DockerChallengeType(BaseChallenge):
         DockerChallenge.query.filter_by(id=challenge.id).delete()
         Challenges.query.filter_by(id=challenge.id).delete()
         db.session.commit()
+        invalidate_compiled_flags(challenge.id)
 
     @staticmethod
     def read(challenge):
@@ -482,9 +1523,13 @@ class DockerChallengeType(BaseChallenge):
                 """
 
         data = request.form or request.get_json()
-        print(request.get_json())
-        print(data)
         submission = data["submission"].strip()
+        # Static and regex flags are matched from their compiled form, without loading the Flags
+        compiled = get_compiled_flags(challenge.id)
+        if compiled.supported:
+            if compiled.match(submission):
+                return True, "Correct"
+            return False, "Incorrect"
         flags = Flags.query.filter_by(challenge_id=challenge.id).all()
         for flag in flags:
             if get_flag_class(flag.type).compare(flag, submission):
@@ -503,30 +1548,34 @@ class DockerChallengeType(BaseChallenge):
                 """
         data = request.form or request.get_json()
         submission = data["submission"].strip()
-        docker = DockerConfig.query.filter_by(id=1).first()
-        try:
-            if is_teams_mode():
-                docker_containers = DockerChallengeTracker.query.filter_by(
-                    docker_image=challenge.docker_image).filter_by(team_id=team.id).first()
-            else:
-                docker_containers = DockerChallengeTracker.query.filter_by(
-                    docker_image=challenge.docker_image).filter_by(user_id=user.id).first()
-            delete_container(docker, docker_containers.instance_id)
-            DockerChallengeTracker.query.filter_by(instance_id=docker_containers.instance_id).delete()
-        except:
-            pass
         solve = Solves(
             user_id=user.id,
             team_id=team.id if team else None,
             challenge_id=challenge.id,
             ip=get_ip(req=request),
             provided=submission,
+            value=challenge.value   # The scoreboard adds up Solves.value
         )
         db.session.add(solve)
         db.session.commit()
         # trying if this solces the detached instance error...
         #db.session.close()
 
+        # The instance is not needed anymore. It is expired right away and the expiry thread deletes the container
+        # (retrying if the daemon fails), so a slow Docker host never delays the solve.
+        try:
+            tracker_filter = {'team_id': team.id} if is_teams_mode() else {'user_id': user.id}
+            expired = DockerChallengeTracker.query.filter_by(**tracker_filter).filter_by(
+                docker_image=challenge.docker_image).update({'revert_time': unix_time(datetime.utcnow())},
+                                                             synchronize_session=False)
+            db.session.commit()
+            if expired:
+                bump_account_version(tracker_filter)
+                expiry_event.set()
+        except Exception:
+            traceback.print_exc()
+            db.session.rollback()
+
     @staticmethod
     def fail(user, team, challenge, request):
         """
@@ -551,10 +1600,32 @@ class DockerChallengeType(BaseChallenge):
         #db.session.close()
 
 
+def get_unlocked_hint_ids():
+    """
+        Returns the ids of the hints unlocked by the current user/team. Loaded with one query per request and shared by
+        every challenge serialized in it.
+        """
+    if 'docker_unlocked_hints' not in g:
+        if is_teams_mode():
+            account = get_current_team_attrs()
+            unlocks = HintUnlocks.query.filter_by(team_id=account.id) if account else None
+        else:
+            account = get_current_user_attrs()
+            unlocks = HintUnlocks.query.filter_by(user_id=account.id) if account else None
+        if unlocks is None:
+            g.docker_unlocked_hints = set()
+        else:
+            # Unlocks store the id of the unlocked hint in target
+            g.docker_unlocked_hints = set(u.target for u in unlocks.with_entities(HintUnlocks.target))
+    return g.docker_unlocked_hints
+
+
 class DockerChallenge(Challenges):
     __mapper_args__ = {'polymorphic_identity': 'docker'}
     id = db.Column(None, db.ForeignKey('challenges.id'), primary_key=True)
     docker_image = db.Column(db.String(128), index=True)
+    # Containers kept created and started for this image so a start is only a hand-out. 0 disables the warm pool.
+    warm_pool_size = db.Column(db.Integer, default=0)
 
     # From Deepseek: Override to_json() to intercept the /api/v1/challenges list
     # endpoint response. This is the API your pentest hit that exposed docker_image.
@@ -580,8 +1651,7 @@ class DockerChallenge(Challenges):
 
         # From Deepseek: Also strip content from hints the user has not purchased,
         # so locked hint text cannot be read from the Network tab.
-        user = get_current_user()
-        team = get_current_team()
+        unlocked_hints = get_unlocked_hint_ids()
         secure_hints = []
 
         for hint in self.hints:
@@ -591,12 +1661,7 @@ class DockerChallenge(Challenges):
                 continue
 
             # Check whether this user/team has unlocked the hint
-            if is_teams_mode():
-                unlocked = HintUnlocks.query.filter_by(team_id=team.id, hint_id=hint.id).first()
-            else:
-                unlocked = HintUnlocks.query.filter_by(user_id=user.id, hint_id=hint.id).first()
-
-            if unlocked:
+            if hint.id in unlocked_hints:
                 # From Deepseek: User paid for this hint, show full content
                 secure_hints.append({"id": hint.id, "content": hint.content, "cost": hint.cost})
             else:
@@ -624,28 +1689,20 @@ class ContainerAPI(Resource):
         if not challenge:
             return abort(403, "No challenge name specified")
         
-        docker = DockerConfig.query.filter_by(id=1).first()
-        containers = DockerChallengeTracker.query.all()
+        docker = get_docker_config()
         if container not in get_repositories(docker, tags=True):
             return abort(403,f"Container {container} not present in the repository.")
-        if is_teams_mode():
-            session = get_current_team()
-            # First we'll delete all old docker containers (+2 hours)
-            for i in containers:
-                if int(session.id) == int(i.team_id) and (unix_time(datetime.utcnow()) - int(i.timestamp)) >= 7200:
-                    delete_container(docker, i.instance_id)
-                    DockerChallengeTracker.query.filter_by(instance_id=i.instance_id).delete()
-                    db.session.commit()
-            check = DockerChallengeTracker.query.filter_by(team_id=session.id).filter_by(docker_image=container).first()
-        else:
-            session = get_current_user()
-            for i in containers:
-                if int(session.id) == int(i.user_id) and (unix_time(datetime.utcnow()) - int(i.timestamp)) >= 7200:
-                    delete_container(docker, i.instance_id)
-                    DockerChallengeTracker.query.filter_by(instance_id=i.instance_id).delete()
-                    db.session.commit()
-            check = DockerChallengeTracker.query.filter_by(user_id=session.id).filter_by(docker_image=container).first()
-        
+        # Old containers (+2 hours) are deleted by the expiry thread
+        session, tracker_filter = get_account_filter()
+        check = DockerChallengeTracker.query.filter_by(**tracker_filter).filter_by(docker_image=container).first()
+        host = get_docker_host(docker)
+
+        # One request at a time per user/team, the previous one is still being worked on.
+        busy = "Your previous challenge instance request is still being processed. Please wait."
+        job = get_account_job(tracker_filter)
+        if job and job['status'] in JOB_ACTIVE_STATES:
+            return abort(403, busy)
+
         # If this container is already created, we don't need another one.
         # Check for stop request first to allow immediate termination
         is_stop_request = request.args.get('stopcontainer')
@@ -659,72 +1716,38 @@ class ContainerAPI(Resource):
         
         # Delete when requested
         elif check != None and request.args.get('stopcontainer'):
-            delete_container(docker, check.instance_id)
-            if is_teams_mode():
-                DockerChallengeTracker.query.filter_by(team_id=session.id).filter_by(docker_image=container).delete()
-            else:
-                DockerChallengeTracker.query.filter_by(user_id=session.id).filter_by(docker_image=container).delete()
-            db.session.commit()
-            return {"result": "Container stopped"}
+            job = enqueue_job('stop', tracker_filter, container, challenge, session.name, host)
+            if job is None:
+                return abort(403, busy)
+            return {"success": True, "data": job}
         
-        # The exception would be if we are reverting a box. So we'll delete it if it exists and has been around for more than 5 minutes.
+        # The exception would be if we are reverting a box. So we'll replace it if it exists and has been around for more than 5 minutes.
         elif check != None:
-            delete_container(docker, check.instance_id)
-            if is_teams_mode():
-                DockerChallengeTracker.query.filter_by(team_id=session.id).filter_by(docker_image=container).delete()
-            else:
-                DockerChallengeTracker.query.filter_by(user_id=session.id).filter_by(docker_image=container).delete()
-            db.session.commit()
-       
-        # 1. STOP REQUEST: Kill and EXIT
-        #elif check != None and request.args.get('stopcontainer'):
-        #    try:
-        #        delete_container(docker, check.instance_id)
-        #        if is_teams_mode():
-        #            DockerChallengeTracker.query.filter_by(team_id=session.id, docker_image=container).delete()
-        #        else:
-        #            DockerChallengeTracker.query.filter_by(user_id=session.id, docker_image=container).delete()
-        #        db.session.commit()
-        #        return {"success": True, "message": "Container stopped"} 
-        #    except Exception as e:
-        #        db.session.rollback()
-        #        return {"success": False, "message": str(e)}, 500
-
-        # 2. REVERT REQUEST: Kill old one, then let the code continue to create a new one
-        #elif check != None:
-        #    delete_container(docker, check.instance_id)
-        #    if is_teams_mode():
-        #        DockerChallengeTracker.query.filter_by(team_id=session.id, docker_image=container).delete()
-        #    else:
-        #        DockerChallengeTracker.query.filter_by(user_id=session.id, docker_image=container).delete()
-        #    db.session.commit()
-            # No return here! We want it to fall through to the creation logic below.
-
-
-        # Check if a container is already running for this user. We need to recheck the DB first
-        containers = DockerChallengeTracker.query.all()
-        for i in containers:
-            if int(session.id) == int(i.user_id):
-                return abort(403,f"Another challenge instance is currently running for challenge:<br><i><b>{i.challenge}</b></i>.<br>Please stop this first.<br>You can only run one challenge instance at a time.")
-
-        portsbl = get_unavailable_ports(docker)
-        create = create_container(docker, container, session.name, portsbl)
-        ports = json.loads(create[1])['HostConfig']['PortBindings'].values()
-        entry = DockerChallengeTracker(
-            team_id=session.id if is_teams_mode() else None,
-            user_id=session.id if not is_teams_mode() else None,
-            docker_image=container,
-            timestamp=unix_time(datetime.utcnow()),
-            revert_time=unix_time(datetime.utcnow()) + 300,
-            instance_id=create[0]['Id'],
-            ports=','.join([p[0]['HostPort'] for p in ports]),
-            host=str(docker.hostname).split(':')[0],
-            challenge=challenge
-        )
-        db.session.add(entry)
-        db.session.commit()
-        #db.session.close()
-        return
+            job = enqueue_job('revert', tracker_filter, container, challenge, session.name, host)
+            if job is None:
+                return abort(403, busy)
+            return {"success": True, "data": job}
+
+        # Check if a container is already running for this user/team.
+        running = DockerChallengeTracker.query.filter_by(**tracker_filter).first()
+        if running:
+            return abort(403,f"Another challenge instance is currently running for challenge:<br><i><b>{running.challenge}</b></i>.<br>Please stop this first.<br>You can only run one challenge instance at a time.")
+
+        # A warm container is handed out in milliseconds, so only a cold start goes through the queue.
+        if not claim_job_slot(tracker_filter):
+            return abort(403, busy)
+        try:
+            warm = claim_warm_container(container)
+            if warm:
+                start_instance(docker, tracker_filter, container, challenge, session.name, host, warm=warm)
+        finally:
+            release_job_slot(tracker_filter)
+        if warm:
+            return {"success": True, "data": {"status": "done", "docker_image": container}}
+        job = enqueue_job('start', tracker_filter, container, challenge, session.name, host)
+        if job is None:
+            return abort(403, busy)
+        return {"success": True, "data": job}
 
 
 active_docker_namespace = Namespace("docker", description='Endpoint to retrieve User Docker Image Status')
@@ -739,40 +1762,44 @@ class DockerStatus(Resource):
 
     @authed_only
     def get(self):
-        docker = DockerConfig.query.filter_by(id=1).first()
-        if is_teams_mode():
-            session = get_current_team()
-            tracker = DockerChallengeTracker.query.filter_by(team_id=session.id)
-        else:
-            session = get_current_user()
-            tracker = DockerChallengeTracker.query.filter_by(user_id=session.id)
+        session, tracker_filter = get_account_filter()
+        # Read first: a job that ran past its deadline is marked failed there, which replaces the version
+        job = get_account_job(tracker_filter)
+        # Nothing changed for this user/team since its last poll, so the browser can reuse its copy
+        etag = '%s-%s' % (get_account_channel(tracker_filter), get_account_version(tracker_filter))
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={'ETag': '"%s"' % etag, 'Cache-Control': 'private, no-cache'})
+        tracker = DockerChallengeTracker.query.filter_by(**tracker_filter)
         data = list()
         for i in tracker:
-            data.append({
-                'id': i.id,
-                'team_id': i.team_id,
-                'user_id': i.user_id,
-                # From Deepseek: The docker_image field in this status response was also
-                # leaking the real image name. view.js matches on item.docker_image to
-                # detect which container belongs to the current challenge, so we MUST
-                # keep returning the real value here — but only for the owner (authed user
-                # seeing their own containers) and admins. This endpoint is already
-                # @authed_only and only returns rows belonging to the current session,
-                # so regular users only ever see their own containers. Admins get the
-                # real name explicitly; all others also get the real name here because
-                # the JS needs it to match the challenge. The pentest finding was from
-                # /api/v1/challenges (the public list), not this endpoint.
-                'docker_image': i.docker_image if is_admin() else i.docker_image,
-                'timestamp': i.timestamp,
-                'revert_time': i.revert_time,
-                'instance_id': i.instance_id,
-                'ports': i.ports.split(','),
-                'host': str(docker.hostname).split(':')[0]
-            })
+            # From Deepseek: The docker_image field in this status response was also
+            # leaking the real image name. view.js matches on item.docker_image to
+            # detect which container belongs to the current challenge, so we MUST
+            # keep returning the real value here — but only for the owner (authed user
+            # seeing their own containers) and admins. This endpoint is already
+            # @authed_only and only returns rows belonging to the current session,
+            # so regular users only ever see their own containers. Admins get the
+            # real name explicitly; all others also get the real name here because
+            # the JS needs it to match the challenge. The pentest finding was from
+            # /api/v1/challenges (the public list), not this endpoint.
+            # The host is the one stored when the instance was started, so the config isn't loaded here.
+            data.append(dict(get_instance_data(i), status='ready'))
+        # Report the instance being started/stopped/reverted, or why that failed
+        if job and (job['status'] in JOB_ACTIVE_STATES or job['status'] == 'failed'):
+            matched = [d for d in data if d['docker_image'] == job['docker_image']]
+            for d in matched:
+                d['status'] = job['status']
+                d['message'] = job['message']
+            if not matched:
+                data.append({
+                    'docker_image': job['docker_image'],
+                    'status': job['status'],
+                    'message': job['message']
+                })
         return {
             'success': True,
             'data': data
-        }
+        }, 200, {'ETag': '"%s"' % etag, 'Cache-Control': 'private, no-cache'}
 
 
 docker_namespace = Namespace("docker", description='Endpoint to retrieve dockerstuff')
@@ -787,7 +1814,7 @@ class DockerAPI(Resource):
 
     @admins_only
     def get(self):
-        docker = DockerConfig.query.filter_by(id=1).first()
+        docker = get_docker_config()
         images = get_repositories(docker, tags=True, repos=docker.repositories)
         if images:
             data = list()
@@ -808,13 +1835,134 @@ class DockerAPI(Resource):
                    }, 400
 
 
+# Only one worker process upgrades the plugin tables at a time, the others wait for it before going on.
+SCHEMA_LOCK_KEY = 'docker_challenges_schema_lock'
+SCHEMA_LOCK_TIMEOUT = 600
+TRACKER_TABLE = 'docker_challenge_tracker'
+
+
+def get_tracker_copy(name):
+    """
+        Returns a docker_challenge_tracker table definition under another name and without indexes, whose names would
+        clash with those of the table being replaced. upgrade_schema() creates them once it took its place.
+        """
+    table = DockerChallengeTracker.__table__.to_metadata(db.MetaData(), name=name)
+    table.indexes.clear()
+    return table
+
+
+def recover_tracker_table():
+    """
+        Finishes a migrate_tracker_table() that was interrupted, before db.create_all() could put an empty table in
+        place of a complete copy.
+        """
+    tables = set(inspect(db.engine).get_table_names())
+    with db.engine.begin() as connection:
+        if TRACKER_TABLE + '_new' in tables and TRACKER_TABLE + '_old' in tables:
+            # The copy was complete and the old table already moved out of the way
+            connection.execute(text(f'ALTER TABLE {TRACKER_TABLE}_new RENAME TO {TRACKER_TABLE}'))
+        elif TRACKER_TABLE + '_new' in tables:
+            # Interrupted during the copy, the old table is still in place and gets copied again
+            connection.execute(text(f'DROP TABLE {TRACKER_TABLE}_new'))
+    with db.engine.begin() as connection:
+        if TRACKER_TABLE + '_old' in tables:
+            connection.execute(text(f'DROP TABLE {TRACKER_TABLE}_old'))
+
+
+def migrate_tracker_table():
+    """
+        Rebuilds docker_challenge_tracker with integer team_id/user_id columns. The table only holds the running
+        instances, so its rows are copied rather than altering the columns in place, which every database does
+        differently. The copy goes into a new table that then takes the place of the old one, so the running instances
+        are never only in a table being written (on MySQL every DDL statement commits on its own).
+        """
+    new = get_tracker_copy(TRACKER_TABLE + '_new')
+    dropped = list()
+    with db.engine.begin() as connection:
+        rows = [dict(r) for r in connection.execute(text(f'SELECT * FROM {TRACKER_TABLE}')).mappings()]
+        users = set(r[0] for r in connection.execute(text('SELECT id FROM users')))
+        teams = set(r[0] for r in connection.execute(text('SELECT id FROM teams')))
+        new.create(bind=connection)
+        for row in rows:
+            # Fresh ids, so the id sequence of the new table stays right on every database
+            del row['id']
+            row['team_id'] = int(row['team_id']) if row['team_id'] else None
+            row['user_id'] = int(row['user_id']) if row['user_id'] else None
+            # Nobody can use the instances of deleted accounts anymore, so they are removed along with their rows
+            if (row['team_id'] and row['team_id'] not in teams) or (row['user_id'] and row['user_id'] not in users):
+                print(f"[Docker Migration] Dropping instance {row['instance_id']} of a deleted account")
+                dropped.append(row['instance_id'])
+                continue
+            connection.execute(new.insert().values(**row))
+    # recover_tracker_table() picks up from any of these steps
+    with db.engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {TRACKER_TABLE} RENAME TO {TRACKER_TABLE}_old'))
+    with db.engine.begin() as connection:
+        connection.execute(text(f'ALTER TABLE {TRACKER_TABLE}_new RENAME TO {TRACKER_TABLE}'))
+    with db.engine.begin() as connection:
+        connection.execute(text(f'DROP TABLE {TRACKER_TABLE}_old'))
+    docker = get_docker_config() if dropped else None
+    for instance_id in dropped:
+        if not docker or not delete_container(docker, instance_id):
+            print(f"[Docker Migration] Could not delete container {instance_id}, remove it by hand")
+
+
+def backfill_solve_values():
+    """
+        Docker solves made before DockerChallengeType.solve stored their value score nothing, give them the value of
+        their challenge. The update goes through the session so the cached scoreboard is rebuilt along with it.
+        """
+    solves = Solves.__table__
+    stale = db.and_(
+        db.or_(solves.c.value == None, solves.c.value == 0),
+        solves.c.challenge_id.in_(db.session.query(DockerChallenge.id).filter(DockerChallenge.value != 0))
+    )
+    if db.session.query(solves.c.id).filter(stale).first() is None:
+        return
+    value = db.session.query(Challenges.value).filter(Challenges.id == solves.c.challenge_id).scalar_subquery()
+    Solves.query.filter(stale).update({Solves.value: value}, synchronize_session=False)
+    db.session.commit()
+
+
+def upgrade_schema():
+    """
+        db.create_all() only creates missing tables, so columns added to existing plugin tables are created here.
+        """
+    columns = [c['name'] for c in inspect(db.engine).get_columns('docker_challenge')]
+    if 'warm_pool_size' not in columns:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE docker_challenge ADD COLUMN warm_pool_size INTEGER DEFAULT 0'))
+    # team_id/user_id used to be strings, with an index on nearly every column
+    columns = inspect(db.engine).get_columns(TRACKER_TABLE)
+    account_column = [c for c in columns if c['name'] == 'user_id'][0]
+    if not isinstance(account_column['type'], db.Integer):
+        migrate_tracker_table()
+    # Same for indexes added to existing tables
+    for table in (DockerChallengeTracker.__table__,):
+        indexes = [i['name'] for i in inspect(db.engine).get_indexes(table.name)]
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=db.engine)
+    backfill_solve_values()
+
+
 def load(app):
     # From Deepseek: Fixed app.db.create_all() → db.create_all() inside app_context().
     # Original app.db.create_all() crashes on modern CTFd because app.db does not exist,
     # causing the module to fail before load() is registered, producing:
     # AttributeError: module 'CTFd.plugins.docker_challenges' has no attribute 'load'
     with app.app_context():
-        db.create_all()
+        # Every worker process loads the plugin, the first one upgrades the tables while the others wait
+        while not cache.add(SCHEMA_LOCK_KEY, True, timeout=SCHEMA_LOCK_TIMEOUT):
+            time.sleep(1)
+        try:
+            recover_tracker_table()
+            db.create_all()
+            upgrade_schema()
+        finally:
+            cache.delete(SCHEMA_LOCK_KEY)
+        # The tracker table is the persisted record of the ports in use
+        port_allocator.rebuild(get_tracked_ports())
     CHALLENGE_CLASSES['docker'] = DockerChallengeType
     @app.template_filter('datetimeformat')
     def datetimeformat(value, format='%Y-%m-%d %H:%M:%S'):
@@ -822,9 +1970,26 @@ def load(app):
     register_plugin_assets_directory(app, base_path='/plugins/docker_challenges/assets')
     define_docker_admin(app)
     define_docker_status(app)
+    define_docker_events(app)
     register_admin_plugin_menu_bar("Docker Config", "/admin/docker_config")
     register_admin_plugin_menu_bar("Docker Status", "/admin/docker_status")
     CTFd_API_v1.add_namespace(docker_namespace, '/docker')
     CTFd_API_v1.add_namespace(container_namespace, '/container')
     CTFd_API_v1.add_namespace(active_docker_namespace, '/docker_status')
     CTFd_API_v1.add_namespace(kill_container, '/nuke')
+
+    # Keep the port allocator in line with the ports published on the daemon
+    thread = threading.Thread(target=reconcile_ports, args=(app,))
+    thread.daemon = True
+    thread.start()
+
+    # Keep the warm pools of the challenges filled
+    thread = threading.Thread(target=refill_warm_pools, args=(app,))
+    thread.daemon = True
+    thread.start()
+    warm_pool_event.set()
+
+    # Kill the instances once their timer runs out
+    thread = threading.Thread(target=expire_instances, args=(app,))
+    thread.daemon = True
+    thread.start()
@@ -0,0 +1,26 @@
+import uuid
+
+from CTFd.cache import cache
+
+
+def get_cache_version(key, timeout=0):
+    """
+    Returns the version token stored under key, creating one when there is none. Data cached per process is tagged
+    with it and rebuilt once the token is replaced with bump_cache_version.
+
+    :param key:
+    :param timeout:
+    :return: str
+    """
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        # Another worker may have set it in the meantime
+        if not cache.add(key, version, timeout=timeout):
+            version = cache.get(key) or version
+    return version
+
+
+def bump_cache_version(key, timeout=0):
+    # A random token rather than a counter, so a flushed cache can never bring an old version back
+    cache.set(key, uuid.uuid4().hex, timeout=timeout)
@@ -1,8 +1,15 @@
+import math
+import re
+import threading
+from array import array
 from dataclasses import dataclass
 
 from flask import Blueprint
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
 
+from CTFd.cache.versions import bump_cache_version, get_cache_version
 from CTFd.exceptions.challenges import (
     ChallengeCreateException,
     ChallengeSolveException,
@@ -21,12 +28,13 @@ from CTFd.models import (
     db,
 )
 from CTFd.plugins import register_plugin_assets_directory
-from CTFd.plugins.challenges.decay import DECAY_FUNCTIONS, logarithmic
+from CTFd.plugins.challenges.decay import DECAY_FUNCTIONS, get_solve_count, logarithmic
 from CTFd.plugins.challenges.logic import (
     challenge_attempt_all,
     challenge_attempt_any,
     challenge_attempt_team,
 )
+from CTFd.utils.modes import get_model
 from CTFd.utils.uploads import delete_file
 from CTFd.utils.user import get_ip
 
@@ -43,15 +51,243 @@ class ChallengeResponse:
         yield self.message
 
 
-def calculate_value(challenge):
+# Value of a linear/logarithmic challenge for every solve count, built once per set of decay parameters. The tables
+# stop where the value stops changing, usually a few dozen entries.
+DECAY_TABLE_SIZE = 10000
+_decay_tables = {}
+_decay_tables_lock = threading.Lock()
+
+
+def decay_value(function, initial, minimum, decay, solve_count):
+    """
+    Same formulas as the linear and logarithmic functions in DECAY_FUNCTIONS, for a given solve count.
+    """
+    if solve_count != 0:
+        solve_count -= 1
+
+    if function == "linear":
+        value = initial - (decay * solve_count)
+    else:
+        # logarithmic() replaces a decay of 0 with 1 as it can't divide by zero
+        if decay == 0:
+            decay = 1
+        value = (((minimum - initial) / (decay**2)) * (solve_count**2)) + initial
+
+    value = math.ceil(value)
+    if value < minimum:
+        value = minimum
+    return value
+
+
+def build_decay_table(challenge):
+    """
+    Builds the value table of a challenge from its current decay parameters.
+
+    :param challenge:
+    :return: (parameters, values, complete) where complete tells that every solve count past the table is worth its
+    last value
+    """
+    params = (challenge.function, challenge.initial, challenge.minimum, challenge.decay)
+    # A linear decay of 0 keeps the initial value. Otherwise the value goes down to the minimum and stays there, unless
+    # the parameters make the curve go up (negative decay, or a logarithmic minimum above the initial value).
+    constant = challenge.function == "linear" and not challenge.decay
+    if challenge.function == "linear":
+        decreasing = challenge.decay >= 0
+    else:
+        decreasing = challenge.minimum <= challenge.initial
+
+    values = array("l")
+    complete = False
+    for solve_count in range(DECAY_TABLE_SIZE):
+        value = decay_value(*params, solve_count)
+        values.append(int(value))
+        # The first two solve counts are worth the same
+        if (constant and solve_count > 0) or (decreasing and value <= challenge.minimum):
+            complete = True
+            break
+
+    table = (params, values, complete)
+    with _decay_tables_lock:
+        _decay_tables[challenge.id] = table
+    return table
+
+
+def get_decay_value(challenge, solve_count):
+    params = (challenge.function, challenge.initial, challenge.minimum, challenge.decay)
+    with _decay_tables_lock:
+        table = _decay_tables.get(challenge.id)
+    if table is None or table[0] != params:
+        table = build_decay_table(challenge)
+
+    _, values, complete = table
+    if solve_count < len(values):
+        return values[solve_count]
+    if complete:
+        return values[-1]
+    return decay_value(*params, solve_count)
+
+
+def compute_value(challenge, solve_count=None):
+    """
+    Returns the current value of a decaying challenge. Linear and logarithmic challenges are looked up in their decay
+    table, for solve_count when it was already counted. Other decay functions are called directly.
+    """
+    if challenge.function in ("linear", "logarithmic"):
+        if solve_count is None:
+            solve_count = get_solve_count(challenge)
+        return get_decay_value(challenge, solve_count)
     f = DECAY_FUNCTIONS.get(challenge.function, logarithmic)
-    value = f(challenge)
+    return f(challenge)
+
+
+def calculate_value(challenge):
+    value = compute_value(challenge)
 
     challenge.value = value
     db.session.commit()
     return challenge
 
 
+def get_solve_count_query(challenge):
+    """
+    Counts the same solves as get_solve_count, as a query that can also be used inside another statement.
+    """
+    Model = get_model()
+    return (
+        db.session.query(db.func.count(Solves.id))
+        .join(Model, Solves.account_id == Model.id)
+        .filter(
+            Solves.challenge_id == challenge.id,
+            Model.hidden == False,  # noqa: E712
+            Model.banned == False,  # noqa: E712
+        )
+    )
+
+
+def update_value(challenge):
+    """
+    Recalculates the value of a decaying challenge after a solve, with a single guarded UPDATE. The update only applies
+    while the solve count is still the one the value was computed from: a concurrent solve that counted differently
+    can't put its value over a newer one, and nothing has to read and lock the row first. Whichever solve counted last
+    writes the value, so it also goes back up after solves were deleted or their accounts banned.
+
+    :param challenge:
+    :return: Challenge object
+    """
+    solve_count = get_solve_count_query(challenge)
+    count = solve_count.scalar()
+    value = compute_value(challenge, count)
+
+    Challenges.query.filter(
+        Challenges.id == challenge.id, solve_count.scalar_subquery() == count
+    ).update({"value": value}, synchronize_session=False)
+    db.session.commit()
+    return challenge
+
+
+class CompiledFlags(object):
+    """
+    The flags of a challenge prepared for matching. Static flags are kept in sets and regex flags are compiled once.
+    Challenges with any other flag type, or a regex that does not compile, are marked unsupported and keep going
+    through their flag classes.
+    """
+
+    def __init__(self, flags):
+        self.static = set()
+        self.static_insensitive = set()
+        self.regexes = []
+        self.supported = True
+        for flag in flags:
+            # Same as the flag classes, which strip the saved flag before comparing
+            content = flag.content.strip()
+            if flag.type == "static":
+                if flag.data == "case_insensitive":
+                    self.static_insensitive.add(content.lower())
+                else:
+                    self.static.add(content)
+            elif flag.type == "regex":
+                try:
+                    self.regexes.append(
+                        re.compile(
+                            content,
+                            re.IGNORECASE if flag.data == "case_insensitive" else 0,
+                        )
+                    )
+                except re.error:
+                    # Let the regex flag class report the parse error
+                    self.supported = False
+            else:
+                self.supported = False
+
+    def match(self, submission):
+        if submission in self.static:
+            return True
+        if submission.lower() in self.static_insensitive:
+            return True
+        for regex in self.regexes:
+            res = regex.match(submission)
+            if res and res.group() == submission:
+                return True
+        return False
+
+
+# Compiled flags are kept per process and rebuilt when the version of the challenge's flags changes. The version lives
+# in the cache so that an edit made through any worker reaches every other one.
+_compiled_flags = {}
+_compiled_flags_lock = threading.Lock()
+
+
+def get_flags_version_key(challenge_id):
+    return f"challenge_flags_version_{challenge_id}"
+
+
+def get_compiled_flags(challenge_id):
+    """
+    Returns the CompiledFlags of a challenge, building them from the Flags table when they changed.
+
+    :param challenge_id:
+    :return: CompiledFlags
+    """
+    version = get_cache_version(get_flags_version_key(challenge_id))
+
+    with _compiled_flags_lock:
+        compiled = _compiled_flags.get(challenge_id)
+    if compiled and compiled[0] == version:
+        return compiled[1]
+
+    flags = CompiledFlags(Flags.query.filter_by(challenge_id=challenge_id).all())
+    with _compiled_flags_lock:
+        _compiled_flags[challenge_id] = (version, flags)
+    return flags
+
+
+def invalidate_compiled_flags(challenge_id):
+    bump_cache_version(get_flags_version_key(challenge_id))
+
+
+@event.listens_for(Flags, "after_insert")
+@event.listens_for(Flags, "after_update")
+@event.listens_for(Flags, "after_delete")
+def flag_changed(mapper, connection, target):
+    # Only invalidate once the change is committed, otherwise another worker could compile the old flags again
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_flag_challenges", set()).add(
+            target.challenge_id
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def flags_committed(session):
+    for challenge_id in session.info.pop("changed_flag_challenges", ()):
+        invalidate_compiled_flags(challenge_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def flags_rolled_back(session):
+    session.info.pop("changed_flag_challenges", None)
+
+
 class BaseChallenge(object):
     id = None
     name = None
@@ -185,6 +421,8 @@ class BaseChallenge(object):
         Challenges.query.filter_by(id=challenge.id).delete()
         cls.challenge_model.query.filter_by(id=challenge.id).delete()
         db.session.commit()
+        # Bulk deletes don't go through the Flags mapper events
+        invalidate_compiled_flags(challenge.id)
 
     @classmethod
     def attempt(cls, challenge, request):
@@ -200,6 +438,14 @@ class BaseChallenge(object):
         data = request.form or request.get_json()
         submission = data["submission"].strip()
 
+        # Any single flag is enough, so the compiled flags can answer without loading the Flags
+        if challenge.logic not in ("all", "team"):
+            compiled = get_compiled_flags(challenge.id)
+            if compiled.supported:
+                if compiled.match(submission):
+                    return ChallengeResponse(status="correct", message="Correct")
+                return ChallengeResponse(status="incorrect", message="Incorrect")
+
         flags = Flags.query.filter_by(challenge_id=challenge.id).all()
 
         if challenge.logic == "any":
@@ -272,7 +518,7 @@ class BaseChallenge(object):
 
         # If the challenge is dynamic we should calculate a new value
         if challenge.function in DECAY_FUNCTIONS:
-            calculate_value(challenge)
+            update_value(challenge)
 
     @classmethod
     def fail(cls, user, team, challenge, request):
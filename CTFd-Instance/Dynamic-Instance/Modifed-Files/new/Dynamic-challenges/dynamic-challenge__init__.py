@@ -6,8 +6,12 @@ from CTFd.exceptions.challenges import (
 )
 from CTFd.models import Challenges, db
 from CTFd.plugins import register_plugin_assets_directory
-from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
-from CTFd.plugins.dynamic_challenges.decay import DECAY_FUNCTIONS, logarithmic
+from CTFd.plugins.challenges import (
+    CHALLENGE_CLASSES,
+    BaseChallenge,
+    build_decay_table,
+    compute_value,
+)
 from CTFd.plugins.migrations import upgrade
 
 
@@ -89,8 +93,7 @@ class DynamicValueChallenge(BaseChallenge):
 
     @classmethod
     def calculate_value(cls, challenge):
-        f = DECAY_FUNCTIONS.get(challenge.function, logarithmic)
-        value = f(challenge)
+        value = compute_value(challenge)
 
         challenge.value = value
         db.session.commit()
@@ -137,17 +140,10 @@ class DynamicValueChallenge(BaseChallenge):
                     raise ChallengeUpdateException(f"Invalid input for '{attr}'")
             setattr(challenge, attr, value)
 
+        # Values for every solve count are computed once here, solves then only look them up
+        build_decay_table(challenge)
         return DynamicValueChallenge.calculate_value(challenge)
 
-    @classmethod
-    def solve(cls, user, team, challenge, request):
-		# This calls the base solve we modified,
-		# which saves the CURRENT value to the solve record.
-        super().solve(user, team, challenge, request)
-
-		# This recalculates the challenge value for the NEXT person.
-        DynamicValueChallenge.calculate_value(challenge)
-
 
 def load(app):
     upgrade(plugin_name="dynamic_challenges")
@@ -556,12 +556,10 @@ class Users(db.Model):
 
     @cache.memoize()
     def get_score(self, admin=False):
-        score = db.func.sum(Challenges.value).label("score")
-        user = (
-            db.session.query(Solves.user_id, score)
-            .join(Users, Solves.user_id == Users.id)
-            .join(Challenges, Solves.challenge_id == Challenges.id)
-            .filter(Users.id == self.id)
+        # Solves are worth the value they were solved at, like on the scoreboard
+        score = db.func.sum(Solves.value).label("score")
+        user = db.session.query(Solves.user_id, score).filter(
+            Solves.user_id == self.id
         )
 
         award_score = db.func.sum(Awards.value).label("award_score")
@@ -587,27 +585,21 @@ class Users(db.Model):
         else:
             return 0
 
-    @cache.memoize()
     def get_place(self, admin=False, numeric=False):
         """
-        This method is generally a clone of CTFd.scoreboard.get_standings.
-        The point being that models.py must be self-reliant and have little
-        to no imports within the CTFd application as importing from the
-        application itself will result in a circular import.
+        Looks the user up in the places computed along with the standings, see CTFd.utils.scores.get_place.
+        The import stays inside the method as importing from the application
+        itself at the top of models.py would result in a circular import.
         """
         from CTFd.utils.humanize.numbers import ordinalize
-        from CTFd.utils.scores import get_user_standings
-
-        standings = get_user_standings(admin=admin)
+        from CTFd.utils.scores import get_place
 
-        for i, user in enumerate(standings):
-            if user.user_id == self.id:
-                n = i + 1
-                if numeric:
-                    return n
-                return ordinalize(n)
-        else:
+        n = get_place("users", self.id, admin=admin)
+        if n is None:
             return None
+        if numeric:
+            return n
+        return ordinalize(n)
 
 
 class Admins(Users):
@@ -845,27 +837,21 @@ class Teams(db.Model):
             score += member.get_score(admin=admin)
         return score
 
-    @cache.memoize()
     def get_place(self, admin=False, numeric=False):
         """
-        This method is generally a clone of CTFd.scoreboard.get_standings.
-        The point being that models.py must be self-reliant and have little
-        to no imports within the CTFd application as importing from the
-        application itself will result in a circular import.
+        Looks the team up in the places computed along with the standings, see CTFd.utils.scores.get_place.
+        The import stays inside the method as importing from the application
+        itself at the top of models.py would result in a circular import.
         """
         from CTFd.utils.humanize.numbers import ordinalize
-        from CTFd.utils.scores import get_team_standings  # noqa: I001
-
-        standings = get_team_standings(admin=admin)
+        from CTFd.utils.scores import get_place  # noqa: I001
 
-        for i, team in enumerate(standings):
-            if team.team_id == self.id:
-                n = i + 1
-                if numeric:
-                    return n
-                return ordinalize(n)
-        else:
+        n = get_place("teams", self.id, admin=admin)
+        if n is None:
             return None
+        if numeric:
+            return n
+        return ordinalize(n)
 
 
 class Submissions(db.Model):
@@ -927,6 +913,10 @@ class Solves(Submissions):
     __table_args__ = (
         db.UniqueConstraint("challenge_id", "user_id"),
         db.UniqueConstraint("challenge_id", "team_id"),
+        # Covers the standings aggregation, which groups solves by user and team and only needs their value and id
+        db.Index(
+            "solves_user_id_team_id_value_id", "user_id", "team_id", "value", "id"
+        ),
         {},
     )
     id = db.Column(
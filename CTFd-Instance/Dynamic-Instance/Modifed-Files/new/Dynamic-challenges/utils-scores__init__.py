@@ -1,333 +1,782 @@
+import datetime
+import threading
+import uuid
+
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
 from sqlalchemy.sql.expression import union_all
 
 from CTFd.cache import cache
-from CTFd.models import Awards, Brackets, Challenges, Solves, Teams, Users, db
+from CTFd.cache.versions import bump_cache_version, get_cache_version
+from CTFd.models import (
+    Awards,
+    Brackets,
+    Configs,
+    Solves,
+    Submissions,
+    Teams,
+    Users,
+    db,
+)
 from CTFd.utils import get_config
 from CTFd.utils.dates import unix_time_to_utc
 from CTFd.utils.modes import get_model
 
+# Leaderboard members start with the score, last date and last id of the account, zero padded so that ordering them
+# as text gives the standings order: highest score first, then whoever reached it first.
+LEADERBOARD_SCORE_OFFSET = 10**12
+LEADERBOARD_EPOCH = datetime.datetime(1970, 1, 1)
+LEADERBOARD_PAGE_SIZE = 500
+LEADERBOARD_REBUILD_TIMEOUT = 60
+
+# Cached standings are keyed by the current generation, which changes whenever something they show is committed. They
+# are never served stale, the timeout only lets the entries of past generations go.
+STANDINGS_GENERATION_KEY = "standings_generation"
+STANDINGS_CACHE_TIMEOUT = 3600
+
+# What the public sees behind a freeze only changes when scores are reset or added with a date before it, which
+# replaces this version. Solves made during the freeze leave it alone. Scores are dated before they are committed, so
+# the public totals are only kept once the freeze is this many seconds old.
+PUBLIC_TOTALS_VERSION_KEY = "standings_public_version"
+PUBLIC_TOTALS_SETTLE_TIME = 60
+
+# The standings of the current generation, kept per process so that reading them doesn't unpickle them every time
+_standings = {"generation": None, "standings": None}
+_standings_lock = threading.Lock()
+
+# KEYS: ranks, entries, ready, changes
+# ARGV: account_id, value, id, date, score offset
+LEADERBOARD_ADD_SCRIPT = """
+redis.call('INCR', KEYS[4])
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    return 0
+end
+local offset = tonumber(ARGV[5])
+local score, id, date = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local member = redis.call('HGET', KEYS[2], ARGV[1])
+if member then
+    local s, d, i = string.match(member, '^(%d+):(%d+):(%d+):')
+    score = score + offset - tonumber(s)
+    date = math.max(date, tonumber(d))
+    id = math.max(id, tonumber(i))
+    redis.call('ZREM', KEYS[1], member)
+end
+member = string.format('%013d:%017d:%012d:%s', offset - score, date, id, ARGV[1])
+redis.call('ZADD', KEYS[1], 0, member)
+redis.call('HSET', KEYS[2], ARGV[1], member)
+return 1
+"""
+
+# KEYS: ranks, entries, ready, changes, rebuilt ranks, rebuilt entries
+# ARGV: changes counter when the rebuild started
+LEADERBOARD_FINISH_SCRIPT = """
+if (redis.call('GET', KEYS[4]) or '') ~= ARGV[1] then
+    redis.call('DEL', KEYS[5], KEYS[6])
+    return 0
+end
+for i = 1, 2 do
+    if redis.call('EXISTS', KEYS[i + 4]) == 1 then
+        redis.call('RENAME', KEYS[i + 4], KEYS[i])
+        redis.call('PERSIST', KEYS[i])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+redis.call('SET', KEYS[3], 1)
+return 1
+"""
+
+
+def to_timestamp(date):
+    # Microseconds, so that dates compare the same way once stored in the leaderboard
+    if date is None:
+        return 0
+    return (date - LEADERBOARD_EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def add_total(totals, account_id, score, date, id):
+    total = totals.get(account_id)
+    if total is None:
+        totals[account_id] = [score, date, id]
+    else:
+        total[0] += score
+        total[1] = max(total[1], date)
+        total[2] = max(total[2], id)
 
-@cache.memoize(timeout=60)
-def get_standings(count=None, bracket_id=None, admin=False, fields=None):
+
+def get_database_totals(freeze=None, connection=None):
     """
-    Get standings as a list of tuples containing account_id, name, and score e.g. [(account_id, team_name, score)].
+    Returns the totals of every user and team, over all of their solves and awards, with a single query. Solves and
+    awards are grouped by (user, team) pair and each pair is added to both its user and its team.
 
-    Ties are broken by who reached a given score first based on the solve ID. Two users can have the same score but one
-    user will have a solve ID that is before the others. That user will be considered the tie-winner.
+    When the scoreboard has a freeze time the same pass also adds up what was scored before it, for the public.
 
-    Challenges & Awards with a value of zero are filtered out of the calculations to avoid incorrect tie breaks.
+    :param freeze: freeze time of the scoreboard, if any
+    :param connection: connection to read with instead of the session
+    :return: {"users": (totals, public_totals), "teams": (totals, public_totals)} where totals map account ids to
+    [score, date, id]
+    """
+    cutoff = unix_time_to_utc(freeze) if freeze else None
+
+    def aggregate(Model):
+        columns = [
+            Model.user_id.label("user_id"),
+            Model.team_id.label("team_id"),
+            db.func.sum(Model.value).label("score"),
+            db.func.max(Model.date).label("date"),
+            db.func.max(Model.id).label("id"),
+        ]
+        if cutoff is not None:
+            public = Model.date < cutoff
+            columns += [
+                db.func.sum(db.case((public, Model.value), else_=0)).label(
+                    "public_score"
+                ),
+                db.func.max(db.case((public, Model.date))).label("public_date"),
+                db.func.max(db.case((public, Model.id))).label("public_id"),
+            ]
+        return db.session.query(*columns).group_by(Model.user_id, Model.team_id)
+
+    # Solves keep the value they were worth when solved, the challenges table isn't needed
+    scores = aggregate(Solves).filter(Solves.value != 0)
+    awards = aggregate(Awards).filter(Awards.value != 0)
+
+    totals = {"users": ({}, {}), "teams": ({}, {})}
+    for row in (connection or db.session).execute(union_all(scores, awards)):
+        for kind, account_id in (("users", row.user_id), ("teams", row.team_id)):
+            if account_id is None:
+                continue
+            admin_totals, public_totals = totals[kind]
+            add_total(
+                admin_totals,
+                account_id,
+                row.score or 0,
+                to_timestamp(row.date),
+                row.id or 0,
+            )
+            # Pairs with nothing before the freeze aren't on the public scoreboard at all
+            if cutoff is not None and row.public_id is not None:
+                add_total(
+                    public_totals,
+                    account_id,
+                    row.public_score or 0,
+                    to_timestamp(row.public_date),
+                    row.public_id,
+                )
+
+    if cutoff is None:
+        totals = {kind: (t[0], t[0]) for kind, t in totals.items()}
+    return totals
+
+
+class Leaderboard(object):
     """
-    if fields is None:
-        fields = []
-    Model = get_model()
-
-    scores = (
-        db.session.query(
-            Solves.account_id.label("account_id"),
-            db.func.sum(Solves.value).label("score"),  # Changed from db.func.sum(Challenges.value).label("score") to db.func.sum(Solves.value).label("score"). This is to let db get from column "Solves"
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
+    Running totals of every user and team, kept in Redis and updated as solves and awards are committed, so reading
+    the standings doesn't need to aggregate both tables. Each kind of account ("users" and "teams") has a sorted set
+    in standings order and a hash with the current member of each account.
+
+    Changes that can't be applied as an increment (edited or deleted solves and awards, users changing team) drop the
+    totals, which are then rebuilt from the database by the next read. A rebuild only takes over if no solve or award
+    came in while it ran.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.add_script = None
+        self.finish_script = None
+
+    def get_client(self):
+        # Only the Redis cache backend has a client, the other ones fall back to the database
+        client = getattr(cache.cache, "_write_client", None)
+        if client is not None and client is not self.client:
+            self.add_script = client.register_script(LEADERBOARD_ADD_SCRIPT)
+            self.finish_script = client.register_script(LEADERBOARD_FINISH_SCRIPT)
+            self.client = client
+        return client
+
+    @staticmethod
+    def key(kind, name):
+        return f"ctfd_leaderboard_{kind}_{name}"
+
+    def keys(self, kind):
+        names = ("ranks", "entries", "ready", "changes")
+        return [self.key(kind, name) for name in names]
+
+    @staticmethod
+    def encode(account_id, score, date, id):
+        return "%013d:%017d:%012d:%d" % (
+            LEADERBOARD_SCORE_OFFSET - score,
+            date,
+            id,
+            account_id,
+        )
+
+    @staticmethod
+    def decode(member):
+        if isinstance(member, bytes):
+            member = member.decode()
+        score, date, id, account_id = member.split(":")
+        return (
+            int(account_id),
+            LEADERBOARD_SCORE_OFFSET - int(score),
+            int(date),
+            int(id),
+        )
+
+    def add(self, kind, account_id, value, id, date):
+        self.add_script(
+            keys=self.keys(kind),
+            args=[
+                account_id,
+                value,
+                id,
+                to_timestamp(date),
+                LEADERBOARD_SCORE_OFFSET,
+            ],
         )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.account_id)
-    )
-
-    awards = (
-        db.session.query(
-            Awards.account_id.label("account_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
+
+    def reset(self, kind):
+        ranks, entries, ready, changes = self.keys(kind)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incr(changes)
+        pipe.delete(ready, ranks, entries)
+        pipe.execute()
+
+    def apply(self, changes):
+        """
+        Applies the changes recorded by a committed session.
+
+        :param changes: list of ("add", kind, account_id, value, id, date) and ("reset", kind)
+        """
+        if self.get_client() is None:
+            return
+
+        resets = {change[1] for change in changes if change[0] == "reset"}
+        try:
+            for change in changes:
+                if change[0] == "add" and change[1] not in resets:
+                    self.add(*change[1:])
+            for kind in resets:
+                self.reset(kind)
+        except RedisError:
+            # There is no telling which changes went through, start over from the database
+            try:
+                for kind in {change[1] for change in changes}:
+                    self.reset(kind)
+            except RedisError:
+                pass
+
+    def prepare(self, kind):
+        """
+        Returns True when the totals of kind can be read, rebuilding them first if needed. Only one worker rebuilds
+        at a time, the other ones keep using the database meanwhile.
+        """
+        client = self.get_client()
+        if client is None:
+            return False
+        ranks, entries, ready, changes = self.keys(kind)
+        if client.exists(ready):
+            return True
+
+        lock = self.key(kind, "rebuild")
+        if not client.set(lock, 1, nx=True, ex=LEADERBOARD_REBUILD_TIMEOUT):
+            return False
+        try:
+            return self.rebuild(kind)
+        finally:
+            client.delete(lock)
+
+    def rebuild(self, kind):
+        client = self.client
+        ranks, entries, ready, changes = self.keys(kind)
+        started = client.get(changes) or b""
+
+        suffix = uuid.uuid4().hex
+        new_ranks = self.key(kind, "ranks_" + suffix)
+        new_entries = self.key(kind, "entries_" + suffix)
+        # Read on a connection of its own: the session may be inside a transaction whose snapshot is older than
+        # `started`, and would miss what was committed in between
+        with db.engine.connect() as connection:
+            totals, _ = get_database_totals(connection=connection)[kind]
+        members = {
+            account_id: self.encode(account_id, *total)
+            for account_id, total in totals.items()
+        }
+
+        pipe = client.pipeline(transaction=False)
+        items = list(members.items())
+        for i in range(0, len(items), LEADERBOARD_PAGE_SIZE):
+            chunk = dict(items[i : i + LEADERBOARD_PAGE_SIZE])
+            pipe.zadd(new_ranks, {member: 0 for member in chunk.values()})
+            pipe.hset(new_entries, mapping=chunk)
+        # Leftovers of a worker that died mid rebuild go away on their own
+        pipe.expire(new_ranks, LEADERBOARD_REBUILD_TIMEOUT)
+        pipe.expire(new_entries, LEADERBOARD_REBUILD_TIMEOUT)
+        pipe.execute()
+
+        return bool(
+            self.finish_script(
+                keys=[ranks, entries, ready, changes, new_ranks, new_entries],
+                args=[started],
+            )
+        )
+
+    def read(self, kind, start=0, end=-1):
+        """
+        Returns the totals of the accounts of kind from place start to place end (0 based, inclusive), in standings
+        order as the sorted set already keeps them.
+
+        :return: {account_id: [score, date, id]} in standings order
+        """
+        members = self.client.zrange(self.key(kind, "ranks"), start, end)
+        totals = {}
+        for member in members:
+            account_id, score, date, id = self.decode(member)
+            totals[account_id] = [score, date, id]
+        return totals
+
+
+leaderboard = Leaderboard()
+
+
+def get_standings_generation():
+    return get_cache_version(STANDINGS_GENERATION_KEY)
+
+
+def bump_standings_generation():
+    bump_cache_version(STANDINGS_GENERATION_KEY)
+
+
+def record_standings_change(target, *change):
+    # Only applied once the change is committed, a rolled back solve must not count
+    session = object_session(target)
+    if session is not None:
+        session.info["standings_changed"] = True
+        if change:
+            session.info.setdefault("leaderboard_changes", []).append(change)
+
+
+def has_changes(target, attrs):
+    state = inspect(target)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+@event.listens_for(Solves, "after_insert")
+@event.listens_for(Awards, "after_insert", propagate=True)
+def score_added(mapper, connection, target):
+    # Zero valued solves and awards are left out of the standings
+    if not target.value:
+        return
+    for kind, account_id in (("users", target.user_id), ("teams", target.team_id)):
+        if account_id is not None:
+            record_standings_change(
+                target, "add", kind, account_id, target.value, target.id, target.date
+            )
+
+
+@event.listens_for(Solves, "after_update")
+@event.listens_for(Solves, "after_delete")
+@event.listens_for(Awards, "after_update", propagate=True)
+@event.listens_for(Awards, "after_delete", propagate=True)
+def score_changed(mapper, connection, target):
+    if inspect(target).deleted or has_changes(
+        target, ("value", "user_id", "team_id", "date")
+    ):
+        record_standings_change(target, "reset", "users")
+        record_standings_change(target, "reset", "teams")
+
+
+@event.listens_for(Users, "after_update", propagate=True)
+@event.listens_for(Teams, "after_update", propagate=True)
+def account_changed(mapper, connection, target):
+    if isinstance(target, Users) and has_changes(target, ("team_id",)):
+        record_standings_change(target, "reset", "teams")
+    elif has_changes(target, ("name", "oauth_id", "bracket_id", "hidden", "banned")):
+        record_standings_change(target)
+
+
+@event.listens_for(Users, "after_delete", propagate=True)
+@event.listens_for(Teams, "after_delete", propagate=True)
+@event.listens_for(Brackets, "after_update")
+@event.listens_for(Brackets, "after_delete")
+def account_removed(mapper, connection, target):
+    record_standings_change(target)
+
+
+@event.listens_for(Configs, "after_insert")
+@event.listens_for(Configs, "after_update")
+@event.listens_for(Configs, "after_delete")
+def config_changed(mapper, connection, target):
+    if target.key in ("freeze", "user_mode"):
+        record_standings_change(target)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def bulk_changed(orm_execute_state):
+    # Bulk updates and deletes (e.g. Solves.query.filter_by(...).delete()) don't go through the mapper events
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+
+    info = orm_execute_state.session.info
+    kinds = ()
+    if mapper.class_ is Submissions or issubclass(mapper.class_, (Solves, Awards)):
+        kinds = ("users", "teams")
+    elif issubclass(mapper.class_, Users):
+        kinds = ("teams",)
+    elif not issubclass(mapper.class_, (Teams, Brackets, Configs)):
+        return
+
+    info["standings_changed"] = True
+    for kind in kinds:
+        info.setdefault("leaderboard_changes", []).append(("reset", kind))
+
+
+@event.listens_for(Session, "after_commit")
+def standings_committed(session):
+    changes = session.info.pop("leaderboard_changes", None)
+    if changes:
+        leaderboard.apply(changes)
+        settled = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=PUBLIC_TOTALS_SETTLE_TIME
         )
-        .filter(Awards.value != 0)
-        .group_by(Awards.account_id)
-    )
+        for change in changes:
+            if change[0] == "reset" or (change[5] is not None and change[5] < settled):
+                bump_cache_version(PUBLIC_TOTALS_VERSION_KEY)
+                break
+    if session.info.pop("standings_changed", False):
+        bump_standings_generation()
+
+
+@event.listens_for(Session, "after_rollback")
+def standings_rolled_back(session):
+    session.info.pop("leaderboard_changes", None)
+    session.info.pop("standings_changed", None)
 
+
+class Standing(tuple):
     """
-    Filter out solves and awards that are before a specific time point.
+    A row of the standings. Like a query row it can be read by position or by column name, and unlike a namedtuple
+    built on the fly it can be pickled into the cache.
     """
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
 
+    def __new__(cls, fields, values):
+        standing = super(Standing, cls).__new__(cls, values)
+        standing._fields = tuple(fields)
+        return standing
+
+    def __getattr__(self, name):
+        if name == "_fields":
+            raise AttributeError(name)
+        try:
+            return self[self._fields.index(name)]
+        except ValueError:
+            raise AttributeError(name)
+
+    def __reduce__(self):
+        return (Standing, (self._fields, tuple(self)))
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+
+# Columns of each view of the standings, the same as the columns of the queries they replaced
+STANDINGS_COLUMNS = {
+    "accounts": ("account_id", "oauth_id", "name", "bracket_id", "bracket_name"),
+    "users": ("user_id", "oauth_id", "name", "team_id", "bracket_id", "bracket_name"),
+    "teams": ("team_id", "oauth_id", "name", "bracket_id", "bracket_name"),
+}
+
+
+def order_totals(totals):
+    # Highest score first, ties go to whoever reached it first, then to the lowest id as the dates may be equal. This
+    # is the order of the leaderboard's sorted set.
+    return dict(sorted(totals.items(), key=lambda t: (-t[1][0], t[1][1], t[1][2])))
+
+
+def get_leaderboard_totals():
     """
-    Combine awards and solves with a union. They should have the same amount of columns
+    Returns the totals of the leaderboard in the same shape as get_database_totals, in standings order, or None when
+    it can't be used. Nothing is frozen in the leaderboard, the public totals are the same as the admin ones.
     """
-    results = union_all(scores, awards).alias("results")
-
+    try:
+        if not (leaderboard.prepare("users") and leaderboard.prepare("teams")):
+            return None
+        totals = {}
+        for kind in ("users", "teams"):
+            kind_totals = leaderboard.read(kind)
+            totals[kind] = (kind_totals, kind_totals)
+        return totals
+    except RedisError:
+        return None
+
+
+@cache.memoize(timeout=STANDINGS_CACHE_TIMEOUT)
+def compute_public_totals(freeze, version):
     """
-    Sum each of the results by the team id to get their score.
+    Returns the public totals of get_database_totals for a freeze time, in standings order.
+
+    :return: {"users": public_totals, "teams": public_totals}
     """
-    sumscores = (
-        db.session.query(
-            results.columns.account_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
+    return {
+        kind: order_totals(public_totals)
+        for kind, (_, public_totals) in get_database_totals(freeze).items()
+    }
+
+
+def get_public_totals(freeze):
+    if datetime.datetime.utcnow() < unix_time_to_utc(freeze) + datetime.timedelta(
+        seconds=PUBLIC_TOTALS_SETTLE_TIME
+    ):
+        return compute_public_totals.uncached(freeze, None)
+    return compute_public_totals(freeze, get_cache_version(PUBLIC_TOTALS_VERSION_KEY))
+
+
+def get_accounts(Model, ids):
+    columns = [Model.id, Model.oauth_id, Model.name]
+    if Model is Users:
+        columns.append(Model.team_id)
+    columns += [
+        Model.bracket_id,
+        Brackets.name.label("bracket_name"),
+        Model.hidden,
+        Model.banned,
+    ]
+
+    accounts = {}
+    ids = list(ids)
+    for i in range(0, len(ids), LEADERBOARD_PAGE_SIZE):
+        query = (
+            db.session.query(*columns)
+            .join(Brackets, isouter=True)
+            .filter(Model.id.in_(ids[i : i + LEADERBOARD_PAGE_SIZE]))
         )
-        .group_by(results.columns.account_id)
-        .subquery()
-    )
+        for row in query:
+            accounts[row.id] = row
+    return accounts
 
-    """
-    Admins can see scores for all users but the public cannot see banned users.
 
-    Filters out banned users.
-    Properly resolves value ties by ID.
+def standings_columns(view, admin):
+    if admin:
+        return STANDINGS_COLUMNS[view] + ("hidden", "banned", "score")
+    return STANDINGS_COLUMNS[view] + ("score",)
+
+
+def rank_accounts(totals, accounts, kind, admin):
+    # The totals come in standings order, see order_totals
+    columns = STANDINGS_COLUMNS[kind]
+    names = standings_columns(kind, admin)
+    standings = []
+    for account_id, (score, _date, _id) in totals.items():
+        account = accounts.get(account_id)
+        if account is None:
+            continue
+        if not admin and (account.hidden or account.banned):
+            continue
+        values = list(account[: len(columns)])
+        if admin:
+            values += [account.hidden, account.banned]
+        values.append(score)
+        standings.append(Standing(names, values))
+    return standings
+
+
+def as_accounts_view(standings, admin):
+    # Same rows, named like get_standings' (account_id instead of user_id/team_id, no team_id)
+    names = standings_columns("accounts", admin)
+    return [Standing(names, [s[0]] + [getattr(s, n) for n in names[1:]]) for s in standings]
+
 
-    Different databases treat time precision differently so resolve by the row ID instead.
+@cache.memoize(timeout=STANDINGS_CACHE_TIMEOUT)
+def compute_standings(generation):
     """
-    if admin:
-        standings_query = (
-            db.session.query(
-                Model.id.label("account_id"),
-                Model.oauth_id.label("oauth_id"),
-                Model.name.label("name"),
-                Model.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                Model.hidden,
-                Model.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Model.id == sumscores.columns.account_id)
-            .join(Brackets, isouter=True)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Model.id.label("account_id"),
-                Model.oauth_id.label("oauth_id"),
-                Model.name.label("name"),
-                Model.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Model.id == sumscores.columns.account_id)
-            .join(Brackets, isouter=True)
-            .filter(Model.banned == False, Model.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
+    Computes every view of the standings of a standings generation in one pass: the totals of all users and teams are
+    read once, from the Redis leaderboard or with a single query, and every view is built from them. Behind a freeze
+    the public totals come from get_public_totals, which only runs its query again when scores before the freeze
+    change.
 
-    # Filter on a bracket if asked
-    if bracket_id is not None:
-        standings_query = standings_query.filter(Model.bracket_id == bracket_id)
+    Ties are broken by who reached a given score first based on the solve ID. Two users can have the same score but one
+    user will have a solve ID that is before the others. That user will be considered the tie-winner.
 
-    # Only select a certain amount of users if asked.
-    if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
+    Solves & Awards with a value of zero are filtered out of the calculations to avoid incorrect tie breaks. Solves
+    count for the value they were worth when solved.
+
+    Admins can see scores for all users but the public cannot see banned or hidden users, nor what was scored after
+    the freeze.
 
+    :return: (views, places) where views is {(view, admin, bracket_id): standings} for the "accounts" (users or teams
+    depending on the mode), "users" and "teams" views, with a bracket_id of None for the standings of every bracket,
+    and places is {(view, admin): {account_id: place}}
+    """
+    freeze = get_config("freeze")
+    frozen = freeze and datetime.datetime.utcnow() >= unix_time_to_utc(freeze)
+
+    totals = get_leaderboard_totals()
+    if totals is None:
+        totals = {}
+        for kind, (kind_totals, _) in get_database_totals().items():
+            kind_totals = order_totals(kind_totals)
+            totals[kind] = (kind_totals, kind_totals)
+    if frozen:
+        public_totals = get_public_totals(freeze)
+        totals = {kind: (t[0], public_totals[kind]) for kind, t in totals.items()}
+
+    mode_kind = "teams" if get_model() is Teams else "users"
+    views = {}
+    for kind, Model in (("users", Users), ("teams", Teams)):
+        admin_totals, public_totals = totals[kind]
+        accounts = get_accounts(Model, set(admin_totals) | set(public_totals))
+        for admin, kind_totals in ((True, admin_totals), (False, public_totals)):
+            standings = rank_accounts(kind_totals, accounts, kind, admin)
+            views[(kind, admin, None)] = standings
+            if kind == mode_kind:
+                views[("accounts", admin, None)] = as_accounts_view(standings, admin)
+
+    places = {}
+    for (view, admin, _), standings in list(views.items()):
+        places[(view, admin)] = {s[0]: i for i, s in enumerate(standings, start=1)}
+        for standing in standings:
+            if standing.bracket_id is not None:
+                key = (view, admin, standing.bracket_id)
+                views.setdefault(key, []).append(standing)
+    return views, places
+
+
+@cache.memoize(timeout=STANDINGS_CACHE_TIMEOUT)
+def compute_top_standings(generation, view, count, admin):
+    """
+    Returns the first count standings of a view of a standings generation, read from the top of the Redis leaderboard,
+    or None when the leaderboard can't be used. The public skips hidden and banned accounts, so the leaderboard is read
+    count places at a time until there are enough. Nothing is frozen in the leaderboard, only admins are served from
+    it behind a freeze.
+    """
+    freeze = get_config("freeze")
+    if not admin and freeze and datetime.datetime.utcnow() >= unix_time_to_utc(freeze):
+        return None
+
+    mode_kind = "teams" if get_model() is Teams else "users"
+    kind = mode_kind if view == "accounts" else view
+    Model = Teams if kind == "teams" else Users
+    standings = []
+    try:
+        if not leaderboard.prepare(kind):
+            return None
+        start = 0
+        while len(standings) < count:
+            totals = leaderboard.read(kind, start, start + count - 1)
+            if not totals:
+                break
+            accounts = get_accounts(Model, totals)
+            standings += rank_accounts(totals, accounts, kind, admin)
+            start += count
+    except RedisError:
+        return None
+
+    standings = standings[:count]
+    if view == "accounts":
+        standings = as_accounts_view(standings, admin)
     return standings
 
 
-@cache.memoize(timeout=60)
-def get_team_standings(count=None, bracket_id=None, admin=False, fields=None):
-    if fields is None:
-        fields = []
-    scores = (
-        db.session.query(
-            Solves.team_id.label("team_id"),
-            db.func.sum(Challenges.value).label("score"),
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
-        )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.team_id)
-    )
-
-    awards = (
-        db.session.query(
-            Awards.team_id.label("team_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
-        )
-        .filter(Awards.value != 0)
-        .group_by(Awards.team_id)
-    )
+def get_top_standings(view, count, admin):
+    """
+    Returns the first count standings of a view without computing the whole standings, or None when they should be
+    taken from get_current_standings (already computed in this process, or no leaderboard).
+    """
+    generation = get_standings_generation()
+    with _standings_lock:
+        if _standings["generation"] == generation:
+            return None
+    return compute_top_standings(generation, view, count, bool(admin))
 
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
-
-    results = union_all(scores, awards).alias("results")
-
-    sumscores = (
-        db.session.query(
-            results.columns.team_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
-        )
-        .group_by(results.columns.team_id)
-        .subquery()
-    )
 
-    if admin:
-        standings_query = (
-            db.session.query(
-                Teams.id.label("team_id"),
-                Teams.oauth_id.label("oauth_id"),
-                Teams.name.label("name"),
-                Teams.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                Teams.hidden,
-                Teams.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Teams.id == sumscores.columns.team_id)
-            .join(Brackets, isouter=True)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Teams.id.label("team_id"),
-                Teams.oauth_id.label("oauth_id"),
-                Teams.name.label("name"),
-                Teams.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Teams.id == sumscores.columns.team_id)
-            .join(Brackets, isouter=True)
-            .filter(Teams.banned == False)
-            .filter(Teams.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
+def get_current_standings():
+    """
+    Returns compute_standings for the current standings generation.
+    """
+    generation = get_standings_generation()
+    with _standings_lock:
+        if _standings["generation"] == generation:
+            return _standings["standings"]
+
+    standings = compute_standings(generation)
+    with _standings_lock:
+        _standings["generation"] = generation
+        _standings["standings"] = standings
+    return standings
+
+
+def get_fields(Model, standings, fields):
+    """
+    Adds the values of extra account columns to standings, with one query.
+    """
+    query = db.session.query(Model.id, *fields)
+    names = tuple(column["name"] for column in query.column_descriptions[1:])
+
+    ids = [standing[0] for standing in standings]
+    values = {}
+    for i in range(0, len(ids), LEADERBOARD_PAGE_SIZE):
+        for row in query.filter(Model.id.in_(ids[i : i + LEADERBOARD_PAGE_SIZE])):
+            values[row[0]] = row[1:]
+
+    return [
+        Standing(
+            standing._fields + names,
+            list(standing) + list(values.get(standing[0], [None] * len(names))),
         )
+        for standing in standings
+    ]
+
 
+def get_view(view, Model, count=None, bracket_id=None, admin=False, fields=None):
     if bracket_id is not None:
-        standings_query = standings_query.filter(Teams.bracket_id == bracket_id)
+        # The bracket can come straight from the query string
+        try:
+            bracket_id = int(bracket_id)
+        except (TypeError, ValueError):
+            return []
+    standings = None
+    if count is not None and count > 0 and bracket_id is None:
+        # The top of the standings is read straight from the leaderboard
+        standings = get_top_standings(view, count, admin)
+    if standings is None:
+        views, _ = get_current_standings()
+        standings = views.get((view, bool(admin), bracket_id), [])
+        if count is not None:
+            standings = standings[:count]
+    if fields:
+        standings = get_fields(Model, standings, fields)
+    return standings
 
-    if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
 
-    return standings
+def get_standings(count=None, bracket_id=None, admin=False, fields=None):
+    """
+    Get standings as a list of tuples containing account_id, name, and score e.g. [(account_id, team_name, score)].
 
+    Every view of the standings is computed at once per standings generation, see compute_standings.
+    """
+    return get_view("accounts", get_model(), count, bracket_id, admin, fields)
 
-@cache.memoize(timeout=60)
-def get_user_standings(count=None, bracket_id=None, admin=False, fields=None):
-    if fields is None:
-        fields = []
-    scores = (
-        db.session.query(
-            Solves.user_id.label("user_id"),
-            db.func.sum(Challenges.value).label("score"),
-            db.func.max(Solves.id).label("id"),
-            db.func.max(Solves.date).label("date"),
-        )
-        .join(Challenges)
-        .filter(Challenges.value != 0)
-        .group_by(Solves.user_id)
-    )
-
-    awards = (
-        db.session.query(
-            Awards.user_id.label("user_id"),
-            db.func.sum(Awards.value).label("score"),
-            db.func.max(Awards.id).label("id"),
-            db.func.max(Awards.date).label("date"),
-        )
-        .filter(Awards.value != 0)
-        .group_by(Awards.user_id)
-    )
 
-    freeze = get_config("freeze")
-    if not admin and freeze:
-        scores = scores.filter(Solves.date < unix_time_to_utc(freeze))
-        awards = awards.filter(Awards.date < unix_time_to_utc(freeze))
-
-    results = union_all(scores, awards).alias("results")
-
-    sumscores = (
-        db.session.query(
-            results.columns.user_id,
-            db.func.sum(results.columns.score).label("score"),
-            db.func.max(results.columns.id).label("id"),
-            db.func.max(results.columns.date).label("date"),
-        )
-        .group_by(results.columns.user_id)
-        .subquery()
-    )
+def get_team_standings(count=None, bracket_id=None, admin=False, fields=None):
+    return get_view("teams", Teams, count, bracket_id, admin, fields)
 
-    if admin:
-        standings_query = (
-            db.session.query(
-                Users.id.label("user_id"),
-                Users.oauth_id.label("oauth_id"),
-                Users.name.label("name"),
-                Users.team_id.label("team_id"),
-                Users.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                Users.hidden,
-                Users.banned,
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Users.id == sumscores.columns.user_id)
-            .join(Brackets, isouter=True)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
-    else:
-        standings_query = (
-            db.session.query(
-                Users.id.label("user_id"),
-                Users.oauth_id.label("oauth_id"),
-                Users.name.label("name"),
-                Users.team_id.label("team_id"),
-                Users.bracket_id.label("bracket_id"),
-                Brackets.name.label("bracket_name"),
-                sumscores.columns.score,
-                *fields,
-            )
-            .join(sumscores, Users.id == sumscores.columns.user_id)
-            .join(Brackets, isouter=True)
-            .filter(Users.banned == False, Users.hidden == False)
-            .order_by(
-                sumscores.columns.score.desc(),
-                sumscores.columns.date.asc(),
-                sumscores.columns.id.asc(),
-            )
-        )
 
-    if bracket_id is not None:
-        standings_query = standings_query.filter(Users.bracket_id == bracket_id)
+def get_user_standings(count=None, bracket_id=None, admin=False, fields=None):
+    return get_view("users", Users, count, bracket_id, admin, fields)
 
-    if count is None:
-        standings = standings_query.all()
-    else:
-        standings = standings_query.limit(count).all()
 
-    return standings
+def get_place(view, account_id, admin=False):
+    """
+    Returns the place (starting at 1) of an account in a view of the standings, or None when it isn't in them.
+
+    :param view: "accounts", "users" or "teams"
+    :param account_id:
+    :param admin: place among every account instead of the public standings
+    :return: int or None
+    """
+    _, places = get_current_standings()
+    return places[(view, bool(admin))].get(account_id)
@@ -14,6 +14,7 @@ CTFd._internal.challenge.render = function(markdown) {
 CTFd._internal.challenge.postRender = function() {
     const containername = CTFd._internal.challenge.data.docker_image;
     get_docker_status(containername);
+    listen_docker_events(containername);
     createWarningModalBody();
 }
 
@@ -24,7 +25,39 @@ function createWarningModalBody(){
     }
 }
 
+function listen_docker_events(container) {
+    // The server pushes every change of our instances (started, stopped, expired...), so there is no need to poll.
+    if (window.dockerEvents) window.dockerEvents.close();
+    window.dockerEvents = new EventSource(CTFd.config.urlRoot + "/events/docker");
+
+    ['provisioning', 'ready'].forEach(type => {
+        window.dockerEvents.addEventListener(type, event => {
+            const item = JSON.parse(event.data);
+            if (item.docker_image == container) render_docker_status(container, [item]);
+        });
+    });
+    window.dockerEvents.addEventListener('failed', event => {
+        // A failed stop/revert can leave the instance running, the status tells which
+        const item = JSON.parse(event.data);
+        if (item.docker_image == container) get_docker_status(container);
+    });
+    ['stopped', 'expired', 'killed'].forEach(type => {
+        window.dockerEvents.addEventListener(type, event => {
+            const item = JSON.parse(event.data);
+            if (item.docker_image == container) render_docker_status(container, []);
+        });
+    });
+}
+
 function get_docker_status(container) {
+    CTFd.fetch("/api/v1/docker_status")
+    .then(response => response.json())
+    .then(result => {
+        render_docker_status(container, result.success && result.data ? result.data : []);
+    });
+}
+
+function render_docker_status(container, items) {
     const containerDiv = CTFd.lib.$('#docker_container');
     const NormalStartButtonHTML = `
         <span>
@@ -33,70 +66,76 @@ function get_docker_status(container) {
             </a>
         </span>`;
 
-    CTFd.fetch("/api/v1/docker_status")
-    .then(response => response.json())
-    .then(result => {
-        if (!result.success || !result.data || result.data.length === 0) {
-            containerDiv.html(NormalStartButtonHTML);
-            return;
-        }
+    if (window.dockerInterval) clearInterval(window.dockerInterval);
+    if (window.dockerStatusTimeout) clearTimeout(window.dockerStatusTimeout);
+
+    let matchFound = false;
+    items.forEach(item => {
+        if (item.docker_image == container && (item.status == 'pending' || item.status == 'running')) {
+            // The instance is still being started/stopped in the background, the 'ready' event will follow.
+            // Check once more later in case the event was missed while the stream reconnected.
+            matchFound = true;
+            containerDiv.html('<div class="text-center"><i class="fas fa-circle-notch fa-spin fa-1x"></i> <small>Preparing your challenge instance...</small></div>');
+            window.dockerStatusTimeout = setTimeout(() => {
+                get_docker_status(container);
+            }, 10000);
+        } else if (item.docker_image == container && item.status == 'failed' && !item.instance_id) {
+            matchFound = true;
+            containerDiv.html(`<small class="text-danger">${item.message}</small><br />` + NormalStartButtonHTML);
+        } else if (item.docker_image == container) {
+            matchFound = true;
+            const ports = String(item.ports).split(',');
+            let data = '';
+            
+            ports.forEach(port => {
+                const cleanPort = port.split('/')[0];
+                const fullAddress = `${item.host}:${cleanPort}`;
+                // Added the href Link format you requested
+                data += `Link: <a href="http://${fullAddress}" target="_blank" style="color: #00bc8c; text-decoration: underline;">${fullAddress}</a><br />`;
+            });
 
-        let matchFound = false;
-        result.data.forEach(item => {
-            if (item.docker_image == container) {
-                matchFound = true;
-                const ports = String(item.ports).split(',');
-                let data = '';
-                
-                ports.forEach(port => {
-                    const cleanPort = port.split('/')[0];
-                    const fullAddress = `${item.host}:${cleanPort}`;
-                    // Added the href Link format you requested
-                    data += `Link: <a href="http://${fullAddress}" target="_blank" style="color: #00bc8c; text-decoration: underline;">${fullAddress}</a><br />`;
-                });
+            const instance_short_id = String(item.instance_id).substring(0, 10);
+            
+            // A failed stop/revert leaves the instance as it was, say why next to it
+            const failure = item.status == 'failed' && item.message ? `<small class="text-danger">${item.message}</small><br />` : '';
+            containerDiv.html(`
+                ${failure}<pre style="color:inherit;">Docker Container Information:<br />${data}</pre>
+                <div class="mb-2">
+                    <a onclick="stop_container('${item.docker_image}');" class="btn btn-danger btn-sm">
+                        <small style="color:white;"><i class="fas fa-stop"></i> <b>STOP INSTANCE</b></small>
+                    </a>
+                </div>
+                <div id="${instance_short_id}_expiry_timer"></div>
+            `);
+
+            const countDownDate = new Date(parseInt(item.revert_time) * 1000).getTime();
+
+            window.dockerInterval = setInterval(function() {
+                const now = new Date().getTime();
+                const distance = countDownDate - now;
+
+                if (distance <= 0) {
+                    // The 'expired' event brings back the start button once the instance is gone, the status is
+                    // fetched again in case that event is missed
+                    clearInterval(window.dockerInterval);
+                    containerDiv.html('<small class="text-info">Instance expired.</small>');
+                    window.dockerStatusTimeout = setTimeout(() => {
+                        get_docker_status(container);
+                    }, 7000);
+                    return;
+                }
 
-                const instance_short_id = String(item.instance_id).substring(0, 10);
-                
-                containerDiv.html(`
-                    <pre style="color:inherit;">Docker Container Information:<br />${data}</pre>
-                    <div class="mb-2">
-                        <a onclick="stop_container('${item.docker_image}');" class="btn btn-danger btn-sm">
-                            <small style="color:white;"><i class="fas fa-stop"></i> <b>STOP INSTANCE</b></small>
-                        </a>
-                    </div>
-                    <div id="${instance_short_id}_expiry_timer"></div>
-                `);
-
-                const countDownDate = new Date(parseInt(item.revert_time) * 1000).getTime();
-                if (window.dockerInterval) clearInterval(window.dockerInterval);
-
-                window.dockerInterval = setInterval(function() {
-                    const now = new Date().getTime();
-                    const distance = countDownDate - now;
-
-                    if (distance <= 0) {
-                        clearInterval(window.dockerInterval);
-                        containerDiv.html('<small class="text-info">Instance expired. Please refresh your browser.</small>');
-                        
-                        // Increased to 7 seconds to ensure the Python thread (which sleeps 3s) has run
-                        setTimeout(() => {
-                            get_docker_status(container);
-                        }, 7000);
-                        return;
-                    }
-
-                    const minutes = Math.floor((distance % (1000 * 60 * 60)) / (1000 * 60));
-                    const seconds = Math.floor((distance % (1000 * 60)) / 1000).toString().padStart(2, '0');
-
-                    CTFd.lib.$(`#${instance_short_id}_expiry_timer`).html(
-                        `<small class="text-muted">Instance expires in: <b>${minutes}:${seconds}</b></small>`
-                    );
-                }, 1000);
-            }
-        });
+                const minutes = Math.floor((distance % (1000 * 60 * 60)) / (1000 * 60));
+                const seconds = Math.floor((distance % (1000 * 60)) / 1000).toString().padStart(2, '0');
 
-        if (!matchFound) containerDiv.html(NormalStartButtonHTML);
+                CTFd.lib.$(`#${instance_short_id}_expiry_timer`).html(
+                    `<small class="text-muted">Instance expires in: <b>${minutes}:${seconds}</b></small>`
+                );
+            }, 1000);
+        }
     });
+
+    if (!matchFound) containerDiv.html(NormalStartButtonHTML);
 }
 function stop_container(container) {
     if (confirm("Are you sure you want to stop: \n" + CTFd._internal.challenge.data.name)) {
@@ -110,7 +149,7 @@ function stop_container(container) {
                 if (response.ok) {
                     updateWarningModal({
                         title: "Instance Stopped",
-                        warningText: "The <br><strong>" + CTFd._internal.challenge.data.name + "</strong><br> challenge instance was stopped successfully.",
+                        warningText: "The <br><strong>" + CTFd._internal.challenge.data.name + "</strong><br> challenge instance is being stopped.",
                         buttonText: "Close",
                         onClose: function () {
                             get_docker_status(container);  // ← Will be called when modal is closed
@@ -146,7 +185,7 @@ function start_container(container) {
     
                 updateWarningModal({
                     title: "Instance Started",
-                    warningText: "A challenge instance is started for you.<br>Note that you can only revert or stop an instance once per 5 minutes!",
+                    warningText: "A challenge instance is being started for you.<br>Note that you can only revert or stop an instance once per 5 minutes!",
                     buttonText: "Got it!"
                 });
 
@@ -212,6 +251,11 @@ function checkForCorrectFlag() {
         // console.log("Challenge window hidden or closed, stopping check.");
         clearInterval(checkInterval);
         checkInterval = null;
+        if (window.dockerEvents) {
+            window.dockerEvents.close();
+            window.dockerEvents = null;
+        }
+        if (window.dockerStatusTimeout) clearTimeout(window.dockerStatusTimeout);
         return;
     }
 
@@ -78,7 +78,7 @@ function get_docker_status(container) {
                         clearInterval(window.dockerInterval);
                         containerDiv.html('<small class="text-info">Instance expired. Resetting UI...</small>');
                         
-                        // Increased to 7 seconds to ensure the Python thread (which sleeps 3s) has run
+                        // Wait 7 seconds so the expiry thread (woken up at the deadline) has removed the instance
                         setTimeout(() => {
                             get_docker_status(container);
                         }, 7000);